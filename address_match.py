@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Normalisasi alamat & pencarian alamat mirip untuk cek duplikat.
+
+Alamat dinormalisasi per token (Jl/Jln -> jalan, Gg -> gang, RT/RW diseragamkan
+dan diurutkan), lalu dipecah menjadi 3-gram karakter. Kandidat dicari lewat
+MinHash LSH di dalam blok (kecamatan, kota/kab, angka alamat) sehingga satu
+pencarian hanya membandingkan segelintir alamat, bukan seluruh isi sheet.
+Lihat bench_address.py untuk mengukur waktu pencarian.
+"""
+
+import regex as re
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+
+# Singkatan umum -> bentuk baku
+ABBREVIATIONS = {
+    "jl": "jalan", "jln": "jalan", "jalan": "jalan", "gg": "gang", "gng": "gang",
+    "no": "nomor", "nmr": "nomor", "nomer": "nomor", "blk": "blok", "kp": "kampung", "kmp": "kampung",
+    "perum": "perumahan", "komp": "komplek", "kompl": "komplek", "kompleks": "komplek",
+    "ds": "desa", "kel": "kelurahan", "kec": "kecamatan", "kab": "kabupaten", "dsn": "dusun",
+}
+# Kata yang dibuang saat membandingkan nama wilayah (blok kecamatan & kota/kab)
+REGION_STOPWORDS = {"kec", "kecamatan", "kab", "kabupaten", "kota", "kodya", "kel", "kelurahan", "desa", "ds"}
+
+_RT_RW_PAIR_RE = re.compile(r'\brt\s*[/.]?\s*rw\W*0*(\d+)\s*[/.-]\s*0*(\d+)')
+_RT_RE = re.compile(r'\brt\W*0*(\d+)')
+_RW_RE = re.compile(r'\brw\W*0*(\d+)')
+_TOKEN_RE = re.compile(r'[a-z]+|\d+')
+_NUMBER_RE = re.compile(r'(?:rt|rw)?\d+')
+
+# 8 band x 4 baris: peluang jadi kandidat ~98% untuk kemiripan 0.8, ~13% untuk 0.5
+NUM_PERM = 32
+BANDS = 8
+_PRIME = (1 << 61) - 1
+_PERMS = [((i * 0x9E3779B97F4A7C15 + 1) % _PRIME | 1, (i * 0xBF58476D1CE4E5B9 + 7) % _PRIME) for i in range(NUM_PERM)]
+
+
+@lru_cache(maxsize=8192)
+def normalize_address(text):
+    """Bentuk baku alamat: token huruf kecil, singkatan diperluas, RT/RW di akhir ('rt2 rw5')."""
+    text = str(text or "").lower()
+    rt = rw = None
+    if m := _RT_RW_PAIR_RE.search(text):
+        rt, rw = m.group(1), m.group(2)
+        text = text[:m.start()] + " " + text[m.end():]
+    else:
+        if m := _RT_RE.search(text):
+            rt = m.group(1)
+            text = text[:m.start()] + " " + text[m.end():]
+        if m := _RW_RE.search(text):
+            rw = m.group(1)
+            text = text[:m.start()] + " " + text[m.end():]
+    tokens = [ABBREVIATIONS.get(t, t) for t in _TOKEN_RE.findall(text)]
+    tokens = [str(int(t)) if t.isdigit() else t for t in tokens]  # '012' == '12'
+    if rt: tokens.append(f"rt{int(rt)}")
+    if rw: tokens.append(f"rw{int(rw)}")
+    return " ".join(tokens)
+
+
+@lru_cache(maxsize=1024)
+def normalize_region(text):
+    """Nama kecamatan/kota tanpa awalan (Kec., Kab., Kota) untuk kunci blok."""
+    return " ".join(t for t in _TOKEN_RE.findall(str(text or "").lower()) if t not in REGION_STOPWORDS)
+
+
+def shingles(normalized, n=3):
+    padded = f" {normalized} "
+    return frozenset(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+
+
+@lru_cache(maxsize=65536)
+def _shingle_hashes(shingle):
+    x = zlib.crc32(shingle.encode())
+    return tuple((a * x + b) % _PRIME for a, b in _PERMS)
+
+
+def minhash(shingle_set):
+    signature = [_PRIME] * NUM_PERM
+    for s in shingle_set:
+        for i, h in enumerate(_shingle_hashes(s)):
+            if h < signature[i]: signature[i] = h
+    return signature
+
+
+def _bands(signature):
+    rows = NUM_PERM // BANDS
+    return [(band, hash(tuple(signature[band * rows:(band + 1) * rows]))) for band in range(BANDS)]
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class AddressIndex:
+    """Indeks alamat mirip: MinHash LSH per blok (kecamatan, kota/kab, angka alamat), dengan verifikasi Jaccard.
+
+    Dua alamat dianggap sama jika kemiripan 3-gram >= threshold dan angka-angkanya
+    (nomor rumah, RT/RW) identik, agar tetangga beda nomor tidak ikut tertahan.
+    Karena angka harus identik, angka ikut menjadi kunci blok: alamat satu jalan
+    dengan nomor berbeda tidak pernah menjadi kandidat. Alamat ternormalisasi yang
+    sama pada hari yang sama hanya disimpan sekali.
+    Tidak thread-safe; pemanggil memegang lock sendiri.
+    """
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        self._entries = {}                 # id -> (hari, blok, alamat ternormalisasi, shingles, nilai)
+        self._ids = {}                     # (hari, blok, alamat ternormalisasi) -> id
+        self._buckets = defaultdict(set)   # (blok, band, hash band) -> {id}
+        self._by_day = defaultdict(list)   # hari -> [id]
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(address, kecamatan, kota_kab):
+        normalized = normalize_address(address)
+        numbers = tuple(sorted(set(_NUMBER_RE.findall(normalized))))
+        return normalized, (normalize_region(kecamatan), normalize_region(kota_kab), numbers)
+
+    def add(self, address, kecamatan, kota_kab, value, day):
+        normalized, block = self._key(address, kecamatan, kota_kab)
+        if not normalized or (day, block, normalized) in self._ids: return
+        grams = shingles(normalized)
+        entry_id, self._next_id = self._next_id, self._next_id + 1
+        self._entries[entry_id] = (day, block, normalized, grams, value)
+        self._ids[(day, block, normalized)] = entry_id
+        self._by_day[day].append(entry_id)
+        for band in _bands(minhash(grams)):
+            self._buckets[(block, *band)].add(entry_id)
+
+    def find(self, address, kecamatan, kota_kab):
+        """Nilai (mis. no WA) dari alamat paling mirip di blok yang sama, atau None."""
+        normalized, block = self._key(address, kecamatan, kota_kab)
+        if not normalized: return None
+        grams = shingles(normalized)
+        candidates = set()
+        for band in _bands(minhash(grams)):
+            candidates |= self._buckets.get((block, *band), set())
+        best, best_score = None, self.threshold
+        for entry_id in candidates:
+            _, _, _, other, value = self._entries[entry_id]
+            score = jaccard(grams, other)
+            if score >= best_score: best, best_score = value, score
+        return best
+
+    def prune(self, oldest_day):
+        """Membuang entri dengan hari < oldest_day."""
+        for day in [d for d in self._by_day if d < oldest_day]:
+            for entry_id in self._by_day.pop(day):
+                _, block, normalized, grams, _ = self._entries.pop(entry_id)
+                del self._ids[(day, block, normalized)]
+                for band in _bands(minhash(grams)):
+                    bucket = self._buckets.get((block, *band))
+                    if bucket is not None:
+                        bucket.discard(entry_id)
+                        if not bucket: del self._buckets[(block, *band)]
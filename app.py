@@ -1,18 +1,40 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
+import csv
+import sys
+import asyncio
 import gspread
+import click
 import telegram
 import logging
 import regex as re
 import json
+import time
+import zlib
+import socket
+import fcntl
+import sqlite3
+import random
+import threading
+import traceback
+from functools import lru_cache, wraps
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 from calendar import month_name
+from telegram.request import HTTPXRequest
+from telegram.error import RetryAfter, TimedOut, NetworkError
 from oauth2client.service_account import ServiceAccountCredentials
-from flask import Flask, request
+from flask import Flask, request, Response, g
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from itertools import chain
+from dataclasses import dataclass, field
+from contextlib import closing
+from sheet_reader import CHUNK_ROWS, iter_rows, find_first_row, invalidate_headers
+from address_match import AddressIndex, normalize_address, normalize_region
 
 # ==================================================
 # ♠️ Inisialisasi & Konfigurasi Global
@@ -31,6 +53,8 @@ app = Flask(__name__)
 TOKEN = os.getenv('TELEGRAM_TOKEN')
 SS_ID = os.getenv('SS_ID')
 ADMIN_ID = os.getenv('ADMIN_ID')
+# User Telegram yang boleh memakai /batch (selain ADMIN_ID), dipisah koma
+BATCH_ADMIN_IDS = {i.strip() for i in f"{ADMIN_ID or ''},{os.getenv('BATCH_ADMIN_IDS', '')}".split(",") if i.strip()}
 SALES_GRP_ID = os.getenv('SALES_GRP_ID')
 SALES_THREAD_ID = os.getenv('SALES_THREAD_ID')
 AGENT_GROUP_ID = os.getenv('AGENT_GROUP_ID')
@@ -45,62 +69,562 @@ SHIP_LOOKUP = {
     "jnt": "J&T Express", "j&t": "J&T Express", "spx": "SPX"
 }
 
-# Path file untuk menyimpan ID pesan (pengganti PropertiesService)
+# File JSON lama untuk ID pesan; isinya dipindahkan sekali ke state SQLite
 MESSAGE_ID_STORE_PATH = 'message_id_store.json'
 
-# Inisialisasi Bot Telegram
-try:
-    bot = telegram.Bot(token=TOKEN)
-    logger.info("Bot Telegram berhasil diinisialisasi.")
-except Exception as e:
-    logger.error(f"Gagal menginisialisasi bot: {e}", exc_info=True)
+# Database SQLite (mode WAL) bersama antar worker: jurnal tulis, dedup, ID pesan & cache
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'bot_state.db')
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 200))
+WRITE_FLUSH_SECONDS = float(os.getenv('WRITE_FLUSH_SECONDS', 2))
 
-# Koneksi ke Google Sheets
-try:
+# Posisi kolom (0-based) pada baris yang ditulis ke Closing / Closing MP
+ROW_COLUMNS = {
+    "INVOICE": 0, "TANGGAL": 1, "CUSTOMER SERVICE": 2, "WHATSAPP": 4, "ALAMAT": 5, "KECAMATAN": 7, "KOTA/KAB": 8,
+    "QTY BOX": 12, "QTY SACHET": 13, "TANGGAL INPUT": 19,
+}
+
+# Backend I/O: 'google' (Sheets + Telegram asli) atau 'fake' (in-memory, lihat fakes.py)
+BOT_BACKEND = os.getenv('BOT_BACKEND', 'google')
+
+# Jumlah worker gunicorn (WEB_CONCURRENCY); batas kirim Telegram dibagi rata antar worker
+WEB_WORKERS = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+
+# Job terjadwal hanya jalan di satu proses server (pemegang file lock); SCHEDULER_ENABLED=0 mematikannya
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+SCHEDULER_LOCK_PATH = os.getenv('SCHEDULER_LOCK_PATH', STATE_DB_PATH + '.scheduler.lock')
+
+# Ukuran pool koneksi HTTPX bersama untuk semua panggilan Bot API
+TG_POOL_SIZE = int(os.getenv('TG_POOL_SIZE', 16))
+
+# Batas kirim Telegram: global (pesan/detik) & per grup (pesan/menit), serta retry
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', 30))
+TG_GROUP_RATE_PER_MIN = float(os.getenv('TG_GROUP_RATE_PER_MIN', 20))
+TG_CHAT_BURST = int(os.getenv('TG_CHAT_BURST', 3))
+TG_MAX_RETRIES = int(os.getenv('TG_MAX_RETRIES', 5))
+# Jendela penggabungan konfirmasi per thread (detik); 0 = tidak digabung
+TG_COALESCE_SECONDS = float(os.getenv('TG_COALESCE_SECONDS', 0))
+TG_MAX_MESSAGE_LEN = 4096
+
+# Umur cache kode agen (detik) sebelum di-refresh di background
+AGENT_CACHE_TTL = int(os.getenv('AGENT_CACHE_TTL', 300))
+
+# Batas penanda update Telegram yang sudah diproses (jumlah key di memori & umur di SQLite)
+DEDUP_MAX_KEYS = int(os.getenv('DEDUP_MAX_KEYS', 10000))
+DEDUP_TTL_HOURS = float(os.getenv('DEDUP_TTL_HOURS', 48))
+
+# Profiler sampling opsional untuk webhook: peluang per update (0 = nonaktif) & folder output
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+# Nama worksheet yang dipakai bot
+SHEET_CLOSING, SHEET_CLOSING_MP, SHEET_AGEN = "Closing", "Closing MP", "AGEN"
+
+# Arsip Closing (opt-in, ARCHIVE_ENABLED=1): jumlah bulan (termasuk bulan ini) yang tetap di sheet & baris per batch pemindahan
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', '0') == '1'
+ARCHIVE_KEEP_MONTHS = max(1, int(os.getenv('ARCHIVE_KEEP_MONTHS', 2)))
+ARCHIVE_BATCH_ROWS = int(os.getenv('ARCHIVE_BATCH_ROWS', 5000))
+
+# Jumlah nomor invoice yang dicadangkan sekaligus per proses dari counter SQLite
+INVOICE_BLOCK_SIZE = int(os.getenv('INVOICE_BLOCK_SIZE', 20))
+# Nomor node (0-999) di akhir invoice agar instance yang tidak berbagi database state tidak bentrok;
+# set unik per instance, default dari hash hostname
+INVOICE_NODE_ID = int(os.getenv('INVOICE_NODE_ID', zlib.crc32(socket.gethostname().encode()) % 1000)) % 1000
+
+# Cek alamat mirip: jendela hari ke belakang (termasuk hari ini) & ambang kemiripan 3-gram (0-1)
+ADDRESS_DUP_DAYS = max(1, int(os.getenv('ADDRESS_DUP_DAYS', 3)))
+ADDRESS_DUP_THRESHOLD = float(os.getenv('ADDRESS_DUP_THRESHOLD', 0.8))
+
+# Interval sinkronisasi ulang indeks duplikat di background (menit)
+DUP_RESYNC_MINUTES = int(os.getenv('DUP_RESYNC_MINUTES', 5))
+
+# ==================================================
+# ♠️ Metrics & Instrumentasi
+# ==================================================
+class Metrics:
+    """Registry metrics sederhana (counter, histogram, gauge) dengan output format teks Prometheus."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)  # (nama, label) -> nilai
+        self._hists = {}                     # (nama, label) -> [bucket..., sum, count]
+        self._gauges = {}                    # nama -> fungsi yang mengembalikan {label: nilai}
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, help_text, value=1, **labels):
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            self._counters[(name, self._labels(labels))] += value
+
+    def observe(self, name, help_text, seconds, **labels):
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            hist = self._hists.setdefault((name, self._labels(labels)), [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound: hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    def gauge(self, name, help_text, fn):
+        """Gauge dihitung saat scrape; fn mengembalikan angka atau dict {nilai_label: angka}."""
+        self._help[name] = ("gauge", help_text)
+        self._gauges[name] = fn
+
+    @staticmethod
+    def _fmt(labels, extra=()):
+        items = list(labels) + list(extra)
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters, hists = dict(self._counters), {k: list(v) for k, v in self._hists.items()}
+        for name, (kind, help_text) in sorted(self._help.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                lines += [f"{name}{self._fmt(l)} {v}" for (n, l), v in counters.items() if n == name]
+            elif kind == "histogram":
+                for (n, l), hist in hists.items():
+                    if n != name: continue
+                    lines += [f'{name}_bucket{self._fmt(l, [("le", b)])} {hist[i]}' for i, b in enumerate(self.BUCKETS)]
+                    lines += [f'{name}_bucket{self._fmt(l, [("le", "+Inf")])} {hist[-1]}',
+                              f"{name}_sum{self._fmt(l)} {hist[-2]}", f"{name}_count{self._fmt(l)} {hist[-1]}"]
+            else:
+                try:
+                    value = self._gauges[name]()
+                except Exception as e:
+                    logger.warning(f"Gauge {name} gagal dihitung: {e}")
+                    continue
+                items = value.items() if isinstance(value, dict) else [(None, value)]
+                lines += [f"{name}{self._fmt([('name', k)] if k is not None else [])} {v}" for k, v in items]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class timed:
+    """Mengukur durasi satu tahap hot path; bisa dipakai sebagai context manager atau decorator."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        metrics.observe("order_stage_duration_seconds", "Durasi per tahap pemrosesan pesanan", time.perf_counter() - self._start, stage=self.stage)
+        if exc_type: metrics.inc("order_stage_errors_total", "Error per tahap pemrosesan pesanan", stage=self.stage)
+
+    def __call__(self, fn):
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timed(self.stage): return await fn(*args, **kwargs)
+            return async_wrapper
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage): return fn(*args, **kwargs)
+        return wrapper
+
+class InstrumentedWorksheet:
+    """Pembungkus worksheet yang menghitung panggilan, error & latensi API Sheets per method."""
+
+    def __init__(self, worksheet):
+        self._ws = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._ws, name)
+        if not callable(attr): return attr
+        @wraps(attr)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            metrics.inc("sheets_api_calls_total", "Panggilan API Google Sheets", method=name, sheet=self._ws.title)
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                metrics.inc("sheets_api_errors_total", "Error API Google Sheets", method=name, sheet=self._ws.title)
+                raise
+            finally:
+                metrics.observe("sheets_api_duration_seconds", "Latensi API Google Sheets", time.perf_counter() - start, method=name)
+        return call
+
+class StackSampler:
+    """Profiler sampling: mengambil stack semua thread secara berkala lalu menulis format 'folded' (flamegraph)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own: continue
+                stack = ";".join(f"{f.name} ({os.path.basename(f.filename)}:{f.lineno})" for f in traceback.extract_stack(frame))
+                self.samples[stack] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self, label):
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{label}.folded")
+        with open(path, 'w') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
+        logger.info(f"Profil webhook disimpan ke {path} ({sum(self.samples.values())} sampel)")
+
+async def _profiled(coro, label):
+    """Menjalankan coroutine sambil di-profile dengan StackSampler."""
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        return await coro
+    finally:
+        await asyncio.to_thread(sampler.stop, label)
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request_time(response):
+    if request.endpoint != 'metrics_endpoint':
+        metrics.observe("http_request_duration_seconds", "Latensi request HTTP", time.perf_counter() - g.request_start,
+                        endpoint=request.endpoint or "unknown", status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ==================================================
+# ♠️ Event Loop & Koneksi Klien
+# ==================================================
+# Event loop asyncio di thread background: semua coroutine Bot API berjalan di sini
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, name="async-loop", daemon=True).start()
+
+def run_async(coro, timeout=None):
+    """Menjalankan coroutine di event loop background dan menunggu hasilnya (untuk kode sinkron)."""
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result(timeout)
+
+async def gather_async(*coros):
+    """asyncio.gather dalam bentuk coroutine agar bisa dikirim ke run_async dari thread lain."""
+    return await asyncio.gather(*coros)
+
+def submit_async(coro):
+    """Menjadwalkan coroutine di event loop background tanpa menunggu."""
+    return asyncio.run_coroutine_threadsafe(coro, _loop)
+
+def _make_bot():
+    if BOT_BACKEND == 'fake':
+        from fakes import FakeBot
+        return FakeBot.from_env()
+    return telegram.Bot(token=TOKEN, request=HTTPXRequest(connection_pool_size=TG_POOL_SIZE, pool_timeout=10.0))
+
+def _open_spreadsheet():
+    if BOT_BACKEND == 'fake':
+        from fakes import FakeSpreadsheet
+        return FakeSpreadsheet.from_env()
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
     creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
     client = gspread.authorize(creds)
-    spreadsheet = client.open_by_key(SS_ID)
-    closing_sheet = spreadsheet.worksheet("Closing")
-    closing_mp_sheet = spreadsheet.worksheet("Closing MP")
-    agen_sheet = spreadsheet.worksheet("AGEN")
-    logger.info(f"Berhasil terhubung ke Google Sheet: {spreadsheet.title}")
-except Exception as e:
-    logger.error(f"GAGAL terhubung ke Google Sheets: {e}", exc_info=True)
+    return client.open_by_key(SS_ID)
+
+class ClientRegistry:
+    """Registry klien Telegram & Google Sheets: koneksi lazy di background, thread-safe, reconnect saat gagal."""
+
+    RETRY_MAX_SECONDS = 60
+
+    def __init__(self, bot_factory=_make_bot, spreadsheet_factory=_open_spreadsheet, sheet_names=(SHEET_CLOSING, SHEET_CLOSING_MP, SHEET_AGEN)):
+        self.bot_factory, self.spreadsheet_factory, self.sheet_names = bot_factory, spreadsheet_factory, sheet_names
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._bot = None
+        self.spreadsheet = None
+        self._sheets = {}
+        self._on_ready = []
+        self._pinned = False
+        self.last_error = None
+        self.connected_at = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
 
-# Cache sederhana untuk message ID yang sudah diproses
-processed_messages = {}
+    @property
+    def bot(self):
+        """Objek Bot dibuat tanpa panggilan jaringan; initialize() dilakukan di thread koneksi."""
+        with self._lock:
+            if self._bot is None: self._bot = self.bot_factory()
+            return self._bot
 
+    def on_ready(self, fn):
+        """Mendaftarkan fungsi pemanasan (warm-up) yang dijalankan setiap kali koneksi siap."""
+        self._on_ready.append(fn)
+        return fn
+
+    def start(self):
+        """Mulai menghubungkan di background (idempoten)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._connect_loop, name="client-connect", daemon=True)
+                self._thread.start()
+
+    def _connect_loop(self):
+        delay = 1
+        while not self._ready.is_set():
+            try:
+                self._connect()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.error(f"GAGAL terhubung ke Telegram/Google Sheets, coba lagi dalam {delay}s: {e}")
+                time.sleep(delay)
+                delay = min(self.RETRY_MAX_SECONDS, delay * 2)
+        for fn in self._on_ready:
+            try: fn()
+            except Exception as e: logger.error(f"Warm-up {getattr(fn, '__qualname__', fn)} gagal: {e}", exc_info=True)
+
+    def _connect(self):
+        run_async(self.bot.initialize())
+        spreadsheet = self.spreadsheet_factory()
+        sheets = {name: InstrumentedWorksheet(spreadsheet.worksheet(name)) for name in self.sheet_names}
+        with self._lock:
+            if not self._pinned:  # klien yang di-pin lewat use() tidak ditimpa, cukup tandai siap
+                self.spreadsheet, self._sheets = spreadsheet, sheets
+                self.last_error, self.connected_at = None, datetime.now()
+        self._ready.set()
+        logger.info(f"Berhasil terhubung ke Google Sheet: {spreadsheet.title}")
+
+    def reconnect(self):
+        """Menandai koneksi rusak lalu menghubungkan ulang di background (tidak berlaku untuk klien yang di-pin)."""
+        with self._lock:
+            if self._pinned: return
+        if self._ready.is_set():
+            logger.warning("Menghubungkan ulang ke Google Sheets...")
+            self._ready.clear()
+            self.start()
+
+    def use(self, bot=None, spreadsheet=None):
+        """Mengganti klien secara langsung (mis. backend palsu di pengujian)."""
+        with self._lock:
+            self._pinned = True
+            if bot is not None: self._bot = bot
+            if spreadsheet is not None:
+                self.spreadsheet = spreadsheet
+                self._sheets = {name: InstrumentedWorksheet(spreadsheet.worksheet(name)) for name in self.sheet_names}
+        self._ready.set()
+
+    def wait(self, timeout=None):
+        self.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError(f"Koneksi Google Sheets belum siap: {self.last_error or 'sedang menghubungkan'}")
+
+    def sheet(self, name):
+        """Worksheet berdasarkan nama; menunggu koneksi bila belum siap."""
+        if not self._ready.is_set(): self.wait(self.RETRY_MAX_SECONDS)
+        return self._sheets[name]
+
+    def status(self):
+        return {'ready': self.ready, 'backend': BOT_BACKEND, 'last_error': self.last_error,
+                'connected_at': self.connected_at.isoformat() if self.connected_at else None}
+
+clients = ClientRegistry()
+
+
+# ==================================================
+# ♠️ Pengiriman Telegram (Rate Limit & Antrean per Chat)
+# ==================================================
+class TokenBucket:
+    """Token bucket sederhana untuk coroutine di event loop yang sama."""
+
+    def __init__(self, rate, capacity):
+        self.rate, self.capacity = rate, capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Menahan bucket (mis. setelah RetryAfter dari Telegram)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class OutboundDispatcher:
+    """Pengirim pesan keluar: antrean berurutan per (chat, thread), token bucket per chat & global, retry sesuai retry_after."""
+
+    IDLE_SECONDS = 60
+    # Hapus pesan tidak termasuk batas kirim per grup: antrean sendiri & hanya token bucket global
+    UNMETERED = {'delete_message', 'delete_messages'}
+
+    def __init__(self):
+        rate = TG_GLOBAL_RATE / WEB_WORKERS
+        self._global = TokenBucket(rate, rate)
+        self._queues = {}   # (chat_id, thread_id) -> asyncio.Queue
+        self._buckets = {}  # chat_id -> TokenBucket
+        self._pending = {}  # (chat_id, thread_id) -> [(teks, future)] untuk penggabungan
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues.values())
+
+    def _bucket(self, chat_id):
+        if chat_id not in self._buckets:
+            is_group = str(chat_id).startswith("-")
+            rate = (TG_GROUP_RATE_PER_MIN / 60 if is_group else 1.0) / WEB_WORKERS
+            self._buckets[chat_id] = TokenBucket(rate, TG_CHAT_BURST)
+        return self._buckets[chat_id]
+
+    async def call(self, target_chat, method, **kwargs):
+        """Mengantrekan satu panggilan Bot API ke antrean target_chat dan menunggu hasilnya."""
+        key = (str(target_chat), method if method in self.UNMETERED else kwargs.get('message_thread_id'))
+        if key not in self._queues:
+            self._queues[key] = asyncio.Queue()
+            asyncio.create_task(self._worker(key))
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[key].put((method, kwargs, future))
+        return await future
+
+    async def _worker(self, key):
+        queue = self._queues[key]
+        while True:
+            try:
+                method, kwargs, future = await asyncio.wait_for(queue.get(), self.IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self._queues[key]
+                    if not any(k[0] == key[0] for k in self._queues): self._buckets.pop(key[0], None)
+                    return
+                continue
+            try:
+                future.set_result(await self._send(key, method, kwargs))
+            except Exception as e:
+                if not future.done(): future.set_exception(e)
+
+    async def _send(self, key, method, kwargs):
+        chat = key[0]
+        for attempt in range(TG_MAX_RETRIES + 1):
+            if method not in self.UNMETERED: await self._bucket(chat).acquire()
+            await self._global.acquire()
+            start = time.perf_counter()
+            metrics.inc("telegram_api_calls_total", "Panggilan Bot API Telegram", method=method)
+            try:
+                result = await getattr(clients.bot, method)(**kwargs)
+                metrics.observe("telegram_api_duration_seconds", "Latensi Bot API Telegram", time.perf_counter() - start, method=method)
+                return result
+            except RetryAfter as e:
+                metrics.inc("telegram_api_errors_total", "Error Bot API Telegram", method=method, error="RetryAfter")
+                if attempt == TG_MAX_RETRIES: raise
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+                logger.warning(f"Telegram 429 untuk chat {chat}, tunggu {delay}s (percobaan {attempt + 1})")
+                self._bucket(chat).pause(delay)
+            except (TimedOut, NetworkError) as e:
+                metrics.inc("telegram_api_errors_total", "Error Bot API Telegram", method=method, error=type(e).__name__)
+                # BadRequest/Forbidden juga turunan NetworkError tapi tidak perlu diulang
+                if attempt == TG_MAX_RETRIES or not (isinstance(e, TimedOut) or type(e) is NetworkError): raise
+                await asyncio.sleep(min(30, 2 ** attempt))
+            metrics.inc("telegram_api_retries_total", "Retry Bot API Telegram", method=method)
+
+    async def send_coalesced(self, chat_id, text, thread_id=None):
+        """Menggabungkan pesan ke thread yang sama dalam jendela TG_COALESCE_SECONDS menjadi satu pesan."""
+        if TG_COALESCE_SECONDS <= 0:
+            return await self.call(chat_id, 'send_message', chat_id=chat_id, text=text, message_thread_id=thread_id)
+        key = (str(chat_id), thread_id)
+        future = asyncio.get_running_loop().create_future()
+        if key not in self._pending:
+            self._pending[key] = []
+            asyncio.get_running_loop().call_later(TG_COALESCE_SECONDS, lambda: asyncio.create_task(self._flush_coalesced(chat_id, thread_id, key)))
+        self._pending[key].append((text, future))
+        return await future
+
+    async def _flush_coalesced(self, chat_id, thread_id, key):
+        items = self._pending.pop(key, [])
+        metrics.inc("telegram_coalesced_messages_total", "Pesan konfirmasi yang digabung", max(0, len(items) - 1))
+        # Kelompokkan agar tiap pesan gabungan tetap di bawah batas 4096 karakter
+        groups, current, size = [], [], 0
+        for text, future in items:
+            if current and size + len(text) + 2 > TG_MAX_MESSAGE_LEN:
+                groups.append(current)
+                current, size = [], 0
+            current.append((text, future))
+            size += len(text) + 2
+        if current: groups.append(current)
+        for group in groups:
+            try:
+                result = await self.call(chat_id, 'send_message', chat_id=chat_id,
+                                         text="\n\n".join(t for t, _ in group), message_thread_id=thread_id)
+                for _, future in group: future.set_result(result)
+            except Exception as e:
+                for _, future in group: future.set_exception(e)
+
+dispatcher = OutboundDispatcher()
 
 # ==================================================
 # ♠️ Fungsi Inti & Helper
 # ==================================================
-def send_msg(chat_id, text, thread_id=None, parse_mode=None):
-    """Mengirim pesan teks ke chat/thread tertentu."""
+async def send_msg(chat_id, text, thread_id=None, parse_mode=None, coalesce=False):
+    """Mengirim pesan teks ke chat/thread tertentu lewat dispatcher (rate limit + retry)."""
     try:
-        bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id, parse_mode=parse_mode)
+        if coalesce: return await dispatcher.send_coalesced(chat_id, text, thread_id)
+        return await dispatcher.call(chat_id, 'send_message', chat_id=chat_id, text=text, message_thread_id=thread_id, parse_mode=parse_mode)
     except Exception as e:
+        metrics.inc("telegram_send_failures_total", "Pesan yang gagal terkirim setelah retry")
         logger.error(f"Gagal mengirim pesan ke {chat_id}: {e}")
 
-def fwd_msg(to_id, from_id, msg_id):
+async def fwd_msg(to_id, from_id, msg_id):
     """Meneruskan (forward) pesan."""
     try:
-        bot.forward_message(chat_id=to_id, from_chat_id=from_id, message_id=msg_id)
+        await dispatcher.call(to_id, 'forward_message', chat_id=to_id, from_chat_id=from_id, message_id=msg_id)
     except Exception as e:
+        metrics.inc("telegram_send_failures_total", "Pesan yang gagal terkirim setelah retry")
         logger.error(f"Gagal forward pesan {msg_id} ke {to_id}: {e}")
         
-def delete_msg(chat_id, message_id):
+async def delete_msg(chat_id, message_id):
     """Menghapus pesan."""
     try:
-        bot.delete_message(chat_id=chat_id, message_id=message_id)
+        await dispatcher.call(chat_id, 'delete_message', chat_id=chat_id, message_id=message_id)
         logger.info(f"Berhasil menghapus pesan {message_id} dari chat {chat_id}")
     except Exception as e:
         logger.warning(f"Gagal menghapus pesan {message_id} dari chat {chat_id}: {e}")
 
+async def delete_msgs(chat_id, message_ids):
+    """Menghapus banyak pesan sekaligus (delete_messages, maksimal 100 ID per panggilan)."""
+    for i in range(0, len(message_ids), 100):
+        chunk = message_ids[i:i + 100]
+        try:
+            await dispatcher.call(chat_id, 'delete_messages', chat_id=chat_id, message_ids=chunk)
+            logger.info(f"Berhasil menghapus {len(chunk)} pesan dari chat {chat_id}")
+        except Exception as e:
+            logger.warning(f"Gagal menghapus pesan {chunk} dari chat {chat_id}: {e}")
+
+_NUM_RE = re.compile(r'Rp?\s*([\d.,]+)\s*k?', re.IGNORECASE)
+_NON_DIGIT_RE = re.compile(r'\D')
+
 def get_num(val_str):
     """Mengambil angka dari string (misal: 'Rp 50k')."""
     if not val_str: return 0
-    match = re.search(r'Rp?\s*([\d.,]+)\s*k?', str(val_str), re.IGNORECASE)
+    match = _NUM_RE.search(str(val_str))
     if not match: return 0
     cleaned = match.group(1).replace('.', '').replace(',', '')
     num = float(cleaned)
@@ -111,7 +635,7 @@ def get_num(val_str):
 def format_phone_number(phone):
     """Membersihkan dan memformat nomor HP ke format 62."""
     if not phone: return ""
-    cleaned = re.sub(r'\D', '', str(phone))
+    cleaned = _NON_DIGIT_RE.sub('', str(phone))
     if cleaned.startswith("0"):
         return "62" + cleaned[1:]
     if not cleaned.startswith("62"):
@@ -132,165 +656,1158 @@ def format_date(dt_obj, fmt):
 # ==================================================
 # ♠️ Logika Pemrosesan Pesanan (Parsing, Validasi, dll)
 # ==================================================
+@dataclass(slots=True)
+class Order:
+    """Hasil parse satu pesan SALES; dipakai ulang untuk validasi, baris sheet & konfirmasi."""
+    text: str
+    is_mp: bool = False
+    platform: str = ""
+    order_id: str = ""
+    qty_box: int = 0
+    qty_sachet: int = 0
+    price: int = 0
+    sku: str = ""
+    total: int = 0
+    ongkir: int = 0
+    ekspedisi: str = ""
+    pembayaran: str = ""
+    nama: str = ""
+    no_hp: str = ""
+    alamat: str = ""
+    kelurahan: str = ""
+    kecamatan: str = ""
+    kota_kab: str = ""
+    kode_pos: str = ""
+    notes: str = ""
+    extra: dict = field(default_factory=dict)
+
+class OrderParser:
+    """Parser pesan SALES sekali jalan dengan regex terkompilasi dan tabel dispatch per key."""
+
+    MP_RE = re.compile(r'SALES\s+\d+\s*-\s*(SHOPEE|LAZADA|TIKTOK|TIK TOK)', re.IGNORECASE)
+    BOX_RE = re.compile(r'(\d+)\s+Box', re.IGNORECASE)
+    SACHET_RE = re.compile(r'(\d+)\s+Sachet', re.IGNORECASE)
+    # Key yang nilainya boleh berlanjut ke baris berikutnya -> atribut Order
+    MULTILINE = {"alamat jalan": "alamat", "desa/kelurahan": "kelurahan", "kecamatan": "kecamatan", "kab/kota": "kota_kab"}
+
+    def __init__(self):
+        fields = {"sku": "sku", "nama": "nama", "kode pos": "kode_pos", **self.MULTILINE}
+        self._dispatch = {key: self._setter(attr) for key, attr in fields.items()}
+        self._dispatch.update({
+            "doorasi": self._doorasi,
+            "total pembayaran": self._setter('total', get_num),
+            "ongkir": self._setter('ongkir', get_num),
+            "no hp": self._setter('no_hp', format_phone_number),
+            "ekspedisi": self._ekspedisi,
+        })
+
+    @staticmethod
+    def _setter(attr, convert=None):
+        if convert: return lambda order, val: setattr(order, attr, convert(val))
+        return lambda order, val: setattr(order, attr, val)
+
+    def _doorasi(self, order, val):
+        order.qty_box = int(m.group(1)) if (m := self.BOX_RE.search(val)) else 0
+        order.qty_sachet = int(m.group(1)) if (m := self.SACHET_RE.search(val)) else 0
+        order.price = get_num(val)
+
+    @staticmethod
+    def _ekspedisi(order, val):
+        parts = [p.strip() for p in val.split("-", 1)]
+        order.ekspedisi = SHIP_LOOKUP.get(parts[0].lower(), parts[0])
+        order.pembayaran = parts[1] if len(parts) > 1 else "-"
+
+    def parse(self, text):
+        order = Order(text=text)
+        lines = text.split('\n')
+        current_key = ""
+        notes_lines = []
+
+        if platform_match := self.MP_RE.search(text):
+            order.is_mp, order.platform = True, platform_match.group(1).upper()
+            if len(lines) > 1:
+                order.order_id = lines.pop(1).strip()
+
+        dispatch, multiline = self._dispatch, self.MULTILINE
+        for line in lines:
+            stripped = line.strip()
+            if not stripped: continue
+
+            if ":" in line:
+                key, val = [x.strip() for x in line.split(":", 1)]
+                current_key = key = key.lower()
+                if handler := dispatch.get(key): handler(order, val)
+                else: order.extra[key] = val
+            elif attr := multiline.get(current_key):
+                setattr(order, attr, getattr(order, attr) + "\n" + stripped)
+            else:
+                notes_lines.append(stripped)
+
+        if not order.is_mp and notes_lines:
+            order.notes = "\n".join(notes_lines)
+        return order
+
+ORDER_PARSER = OrderParser()
+
 def parse_order(text):
-    lines = text.split('\n')
-    data = {}
-    current_key = ""
-    notes_lines = []
-    
-    is_mp = bool(re.search(r'SALES\s+\d+\s*-\s*(SHOPEE|LAZADA|TIKTOK|TIK TOK)', text, re.IGNORECASE))
-    
-    if is_mp and len(lines) > 1:
-        data['order_id'] = lines[1].strip()
-        lines.pop(1)
-    
-    for line in lines:
-        if not line.strip(): continue
-        
-        if ":" in line:
-            key, val = [x.strip() for x in line.split(":", 1)]
-            key = key.lower()
-            current_key = key
-            
-            if key == "doorasi":
-                data['qty_box'] = int(m.group(1)) if (m := re.search(r'(\d+)\s+Box', val, re.I)) else 0
-                data['qty_sachet'] = int(m.group(1)) if (m := re.search(r'(\d+)\s+Sachet', val, re.I)) else 0
-                data['price'] = get_num(val)
-            elif key == "sku": data['sku'] = val
-            elif key == "total pembayaran": data['total pembayaran'] = get_num(val)
-            elif key == "ongkir": data['ongkir'] = get_num(val)
-            elif key == "ekspedisi":
-                parts = [p.strip() for p in val.split("-", 1)]
-                data['ekspedisi'] = SHIP_LOOKUP.get(parts[0].lower(), parts[0])
-                data['pembayaran'] = parts[1] if len(parts) > 1 else "-"
-            elif key == "nama": data['nama'] = val
-            elif key == "no hp": data['no hp'] = format_phone_number(val)
-            elif key == "alamat jalan": data['alamat'] = val
-            elif key == "desa/kelurahan": data['kelurahan'] = val
-            elif key == "kecamatan": data['kecamatan'] = val
-            elif key == "kab/kota": data['kota/kab'] = val
-            elif key == "kode pos": data['kode pos'] = val
-            else: data[key] = val
-        else:
-            if current_key in ["alamat jalan", "desa/kelurahan", "kecamatan", "kab/kota"]:
-                data[current_key] += "\n" + line.strip()
-            else: notes_lines.append(line.strip())
+    return ORDER_PARSER.parse(text)
 
-    if not is_mp and notes_lines:
-        data['notes'] = "\n".join(notes_lines)
-    
-    for k in ['qty_box', 'qty_sachet', 'total pembayaran', 'ongkir']: data.setdefault(k, 0)
-    for k in ['ekspedisi', 'pembayaran', 'kelurahan', 'kecamatan', 'kota/kab', 'kode pos', 'notes', 'nama', 'no hp', 'alamat', 'sku']: data.setdefault(k, "")
-    return data
+REQUIRED_FIELDS = ["Doorasi:", "SKU:", "Ongkir:", "Total Pembayaran:", "Nama:", "No HP:", "Alamat Jalan:", "Desa/Kelurahan:"]
 
-def validate_order(text):
+@timed("validate_order")
+def validate_order(order):
     errs = []
-    required = ["Doorasi:", "SKU:", "Ongkir:", "Total Pembayaran:", "Nama:", "No HP:", "Alamat Jalan:", "Desa/Kelurahan:"]
-    for s in required:
-        if s.lower() not in text.lower(): errs.append(f"🚨 Missing '{s}'")
+    text_lower = order.text.lower()
+    for s in REQUIRED_FIELDS:
+        if s.lower() not in text_lower: errs.append(f"🚨 Missing '{s}'")
     
-    data = parse_order(text)
-    if not data['sku']: errs.append("🚨 Invalid SKU format")
-    sku = data['sku']
-    if sku.startswith("DRSBOX-") and data.get('qty_box') != int(sku.split("-")[1]): errs.append("🚨 Box qty mismatch")
-    elif sku.startswith("DRSA-") and data.get('qty_sachet') != int(sku.split("-")[1]): errs.append("🚨 Sachet qty mismatch")
+    if not order.sku: errs.append("🚨 Invalid SKU format")
+    sku = order.sku
+    if sku.startswith("DRSBOX-") and order.qty_box != int(sku.split("-")[1]): errs.append("🚨 Box qty mismatch")
+    elif sku.startswith("DRSA-") and order.qty_sachet != int(sku.split("-")[1]): errs.append("🚨 Sachet qty mismatch")
     
-    if data['pembayaran'].upper() not in ["COD", "TRANSFER"]:
+    if order.pembayaran.upper() not in ["COD", "TRANSFER"]:
         errs.append("🚨 Invalid payment method. Must be COD or TRANSFER.")
         
     return "\n".join(errs) if errs else None
 
+def build_row(order, invoice_id, cs_name, pay_col):
+    """Menyusun baris Closing / Closing MP dari Order (urutan kolom sesuai sheet)."""
+    now = datetime.now()
+    return [
+        invoice_id, format_date(now, "dd/MM/yyyy"), cs_name, order.nama, order.no_hp,
+        order.alamat, order.kelurahan, order.kecamatan, order.kota_kab, order.kode_pos,
+        "DOORASI", order.sku, order.qty_box, order.qty_sachet, order.total, order.ongkir,
+        order.ekspedisi, pay_col, order.notes, now.strftime("%d/%m/%Y %H:%M:%S")
+    ]
+
 # ==================================================
 # ♠️ Interaksi Sheet & Data Processing
 # ==================================================
+def _normalize_agent_code(code):
+    return " ".join(str(code).split()).lower()
+
+class AgentCodeCache:
+    """Cache kode agen (kolom B sheet AGEN) dalam bentuk set, di-refresh di background sesuai TTL."""
+
+    RETRY_SECONDS = 30
+
+    def __init__(self, sheet_name, ttl=AGENT_CACHE_TTL):
+        self.sheet_name, self.ttl = sheet_name, ttl
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_refresh = 0.0
+        self.codes = []  # kode asli (sudah di-strip), urutan sesuai sheet
+        self._normalized = frozenset()
+        self.loaded_at = None
+        self._shared_at = 0.0  # waktu (epoch) snapshot yang sedang dipakai
+        self.metrics = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'shared_loads': 0, 'refresh_errors': 0}
+
+    def _load(self, codes, updated):
+        with self._lock:
+            self.codes, self._normalized = codes, frozenset(_normalize_agent_code(c) for c in codes)
+            self.loaded_at = datetime.now()
+            self._shared_at = updated
+            self._next_refresh = time.monotonic() + max(0, self.ttl - (time.time() - updated))
+
+    def refresh(self):
+        """Membaca ulang kolom B, kecuali worker lain baru saja menyimpan snapshot.
+
+        Jika gagal, snapshot terakhir tetap dipakai; proses yang belum punya snapshot memakai
+        snapshot SQLite walau sudah kedaluwarsa.
+        """
+        key = f"agent_codes:{self.sheet_name}"
+        codes, updated = shared_state.entry(key)
+        if codes is not None and updated > self._shared_at and time.time() - updated < self.ttl:
+            self._load(codes, updated)
+            self.metrics['shared_loads'] += 1
+            return True
+        try:
+            codes = [c.strip() for c in clients.sheet(self.sheet_name).col_values(2)[1:] if c and c.strip()]
+        except Exception as e:
+            if self.loaded_at is None and codes is not None:
+                # Belum punya snapshot di memori: pakai snapshot SQLite walau sudah lewat TTL daripada fail-open
+                self._load(codes, updated)
+                self.metrics['shared_loads'] += 1
+            with self._lock:
+                self.metrics['refresh_errors'] += 1
+                self._next_refresh = time.monotonic() + min(self.ttl, self.RETRY_SECONDS)
+            if self.loaded_at is None:
+                logger.error(f"Gagal membaca sheet AGEN dan belum ada snapshot, kode agen belum bisa divalidasi: {e}")
+            else:
+                logger.error(f"Gagal membaca sheet AGEN, memakai snapshot dari {datetime.fromtimestamp(self._shared_at):%d/%m %H:%M}: {e}")
+            return False
+        self._load(codes, shared_state.set(key, codes))
+        self.metrics['refreshes'] += 1
+        return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+        def run():
+            try: self.refresh()
+            finally: self._refreshing = False
+        threading.Thread(target=run, name="agent-cache-refresh", daemon=True).start()
+
+    def _fresh(self):
+        """Memastikan ada snapshot; load sinkron hanya jika belum pernah berhasil dimuat."""
+        if self.loaded_at is None:
+            self.metrics['misses'] += 1
+            self.refresh()
+            return
+        if time.monotonic() >= self._next_refresh:
+            self.metrics['stale_hits'] += 1
+            self._refresh_in_background()
+        else:
+            self.metrics['hits'] += 1
+
+    def snapshot(self):
+        self._fresh()
+        return list(self.codes)
+
+    def contains(self, code):
+        """True/False dari snapshot; None jika belum pernah ada snapshot sama sekali."""
+        self._fresh()
+        if self.loaded_at is None: return None
+        return _normalize_agent_code(code) in self._normalized
+
+@timed("is_valid_agent_code")
 def is_valid_agent_code(notes):
     if not isinstance(notes, str) or not notes: return True
     match = re.search(r'^Agen\s+[\w\s]+#\d+', notes, re.IGNORECASE)
     if not match: return True
-    agent_code_from_note = match.group(0).strip()
-    try:
-        codes = agen_sheet.col_values(2)[1:] # Ambil semua dari kolom B, kecuali header
-        return agent_code_from_note in [c.strip() for c in codes]
-    except Exception as e:
-        logger.error(f"Gagal membaca sheet AGEN: {e}")
+    valid = agent_codes.contains(match.group(0).strip())
+    if valid is None:
+        logger.warning("Kode agen belum bisa divalidasi (sheet AGEN belum pernah terbaca).")
         return True
+    return valid
 
-def is_dup_phone(phone, addr, sheet):
-    try:
+@lru_cache(maxsize=4096)
+def _parse_sheet_date(value):
+    """Parse kolom TANGGAL (dd/mm/yyyy) dengan cache karena nilainya banyak berulang."""
+    return datetime.strptime(value, "%d/%m/%Y").date()
+
+def _input_day(value):
+    """Tanggal dari kolom TANGGAL INPUT (dd/mm/yyyy HH:MM:SS)."""
+    return _parse_sheet_date(value[:10])
+
+def _first_row_since(sheet, day):
+    """Perkiraan baris pertama dengan TANGGAL INPUT >= day (kolom ini terurut karena baris selalu di-append)."""
+    return find_first_row(sheet, "TANGGAL INPUT", day, _input_day)
+
+_wal_enabled = False
+
+def _db():
+    """Membuka koneksi ke database state bersama (WAL: pembaca tidak terblokir penulis dari worker lain)."""
+    global _wal_enabled
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30)
+    if not _wal_enabled:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _wal_enabled = True
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class SharedState:
+    """Key-value JSON di SQLite untuk state yang harus sama di semua worker (ID pesan laporan, snapshot cache)."""
+
+    def __init__(self, legacy_json_path=None):
+        with closing(_db()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS shared_state (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)")
+        if legacy_json_path: self._migrate(legacy_json_path)
+
+    def _migrate(self, path):
+        """Memindahkan isi file JSON lama sekali saja, lalu file di-rename agar tidak dibaca lagi."""
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.error(f"File {path} rusak, tidak dimigrasikan: {e}")
+            return
+        now = time.time()
+        with closing(_db()) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO shared_state (key, value, updated) VALUES (?, ?, ?)",
+                             [(k, json.dumps(v), now) for k, v in data.items()])
+        try:
+            os.replace(path, path + '.migrated')
+        except FileNotFoundError:
+            pass  # sudah dipindahkan worker lain
+        logger.info(f"{len(data)} key dari {path} dipindahkan ke state SQLite.")
+
+    def entry(self, key):
+        """(value, updated_epoch) atau (None, 0)."""
+        with closing(_db()) as conn:
+            row = conn.execute("SELECT value, updated FROM shared_state WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0.0)
+
+    def get(self, key, default=None):
+        value, _ = self.entry(key)
+        return default if value is None else value
+
+    def set(self, key, value):
+        now = time.time()
+        with closing(_db()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO shared_state (key, value, updated) VALUES (?, ?, ?)", (key, json.dumps(value), now))
+        return now
+
+shared_state = SharedState(MESSAGE_ID_STORE_PATH)
+
+class InvoiceAllocator:
+    """Nomor invoice gaya Snowflake, INV-{counter}{node:03d}, unik antar proses & instance.
+
+    counter adalah milidetik Unix: blok nomor dicadangkan dari counter SQLite (unik antar
+    proses yang berbagi database state) dan tidak pernah melewati jam, sehingga setelah
+    database state hilang counter lanjut dari jam sekarang tanpa mengulang nomor lama.
+    node (INVOICE_NODE_ID) membedakan instance yang tidak berbagi database state.
+    """
+
+    def __init__(self, block_size=INVOICE_BLOCK_SIZE, node=INVOICE_NODE_ID):
+        self.block_size = max(1, block_size)
+        self.node = node
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        with closing(_db()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS invoice_counter (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _reserve(self):
+        while True:
+            now_ms = int(time.time() * 1000)
+            with closing(_db()) as conn, conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT value FROM invoice_counter WHERE name = 'invoice'").fetchone()
+                start = max((row[0] if row else 0) + 1, now_ms - self.block_size + 1)
+                end = min(start + self.block_size - 1, now_ms)  # tidak pernah mendahului jam
+                if start <= end:
+                    conn.execute("INSERT OR REPLACE INTO invoice_counter (name, value) VALUES ('invoice', ?)", (end,))
+                    self._next, self._end = start, end + 1
+                    return
+            time.sleep(0.001)  # counter sudah menyusul jam, tunggu milidetik berikutnya
+
+    def next(self, prefix="INV"):
+        with self._lock:
+            if self._next >= self._end: self._reserve()
+            number, self._next = self._next, self._next + 1
+        return f"{prefix}-{number}{self.node:03d}"
+
+invoice_ids = InvoiceAllocator()
+
+class WriteBehindQueue:
+    """Jurnal SQLite untuk baris Closing/Closing MP yang ditulis ke sheet di background."""
+
+    LEASE_SECONDS = 120
+    MAX_BACKOFF = 300
+
+    RECONNECT_AFTER_FAILURES = 5
+    # Batch yang ditolak sheet (bukan error koneksi/kuota) sekian kali ditulis per baris agar satu baris
+    # bermasalah tidak menahan antrean; baris yang tetap ditolak (langsung jika 400) dipindah ke write_dead_letter
+    ISOLATE_AFTER_ATTEMPTS = 3
+    DEAD_LETTER_AFTER_ATTEMPTS = 20
+
+    def __init__(self):
+        self._failures = 0
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self.last_flush_latency = 0.0
+        self.last_flush_at = None
+        with closing(_db()) as conn, conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS write_journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sheet TEXT NOT NULL, row TEXT NOT NULL,
+                created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL NOT NULL DEFAULT 0)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS write_dead_letter (
+                id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, row TEXT NOT NULL, created REAL NOT NULL,
+                attempts INTEGER NOT NULL, failed REAL NOT NULL, error TEXT)""")
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, sheet_name, row, update_id=None, message_key=None):
+        """Menyimpan baris ke jurnal (durable) lalu membangunkan writer.
+
+        update_id asal dihapus dari inbox dan pesan asal (message_key) ditandai tertulis dalam
+        transaksi yang sama, jadi update tidak pernah hilang maupun diulang setelah barisnya masuk
+        jurnal. False (tidak ada yang dijurnal) jika pesan itu sudah pernah menghasilkan baris.
+        """
+        with closing(_db()) as conn, conn:
+            if message_key is not None and not processed_updates.mark_written(message_key, conn):
+                return False
+            conn.execute("INSERT INTO write_journal (sheet, row, created) VALUES (?, ?, ?)",
+                         (sheet_name, json.dumps(row), time.time()))
+            if update_id is not None: update_inbox.done(update_id, conn)
+        self.start()
+        self._wake.set()
+        return True
+
+    def depth(self):
+        with closing(_db()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM write_journal").fetchone()[0]
+
+    def dead_letters(self):
+        with closing(_db()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM write_dead_letter").fetchone()[0]
+
+    def pending_rows(self, sheet_name, columns):
+        """Baris yang masih antre untuk sheet tertentu, sebagai tuple `columns` (format sama dengan iter_rows)."""
+        with closing(_db()) as conn:
+            rows = conn.execute("SELECT row FROM write_journal WHERE sheet = ? ORDER BY id", (sheet_name,)).fetchall()
+        return [tuple(str(row[ROW_COLUMNS[c]]) for c in columns) for row in (json.loads(r[0]) for r in rows)]
+
+    def stats(self):
+        return {'depth': self.depth(), 'last_flush_latency': self.last_flush_latency, 'last_flush_at': self.last_flush_at}
+
+    def write_now(self, sheet_name, rows):
+        """Menulis banyak baris dengan satu append_rows. Baris dijurnal dulu dengan lease sehingga
+        jika gagal, writer background yang melanjutkan. True jika langsung tertulis."""
+        now = time.time()
+        with closing(_db()) as conn, conn:
+            ids = [conn.execute("INSERT INTO write_journal (sheet, row, created, attempts, lease_until) VALUES (?, ?, ?, 1, ?)",
+                                (sheet_name, json.dumps(row), now, now + self.LEASE_SECONDS)).lastrowid for row in rows]
+        try:
+            with timed("append_rows"):
+                clients.sheet(sheet_name).append_rows(rows, value_input_option='USER_ENTERED')
+        except Exception as e:
+            delay = self._retry_later(ids, 1)
+            self.start()
+            logger.error(f"Gagal menulis batch {len(rows)} baris ke {sheet_name}, dilanjutkan writer dalam {delay}s: {e}")
+            return False
+        self._finish(ids)
+        logger.info(f"Batch {len(rows)} baris ditulis ke {sheet_name} dengan satu append_rows.")
+        return True
+
+    def _claim(self):
+        """Mengambil satu batch yang belum di-lease agar tidak ditulis ganda oleh worker lain."""
+        now = time.time()
+        with closing(_db()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, sheet, row, attempts FROM write_journal WHERE lease_until < ? ORDER BY id LIMIT ?",
+                                (now, WRITE_BATCH_SIZE)).fetchall()
+            if rows:
+                conn.execute(f"UPDATE write_journal SET lease_until = ?, attempts = attempts + 1 WHERE id IN ({','.join('?' * len(rows))})",
+                             (now + self.LEASE_SECONDS, *[r[0] for r in rows]))
+        return rows
+
+    def _finish(self, ids):
+        with closing(_db()) as conn, conn:
+            conn.execute(f"DELETE FROM write_journal WHERE id IN ({','.join('?' * len(ids))})", ids)
+
+    def _retry_later(self, ids, attempts):
+        delay = min(self.MAX_BACKOFF, 2 ** attempts)
+        with closing(_db()) as conn, conn:
+            conn.execute(f"UPDATE write_journal SET lease_until = ? WHERE id IN ({','.join('?' * len(ids))})",
+                         (time.time() + delay, *ids))
+        return delay
+
+    @staticmethod
+    def _existing_invoices(sheet, values):
+        """Invoice (kolom A) di sheet sejak TANGGAL INPUT tertua pada batch, bukan seluruh kolom."""
+        try:
+            since = min(_input_day(str(v[ROW_COLUMNS["TANGGAL INPUT"]])) for v in values)
+        except (ValueError, IndexError):
+            since = None
+        start = _first_row_since(sheet, since) if since else 2
+        return {invoice for (invoice,) in iter_rows(sheet, (0,), start)}
+
+    @staticmethod
+    def _status(e):
+        return e.response.status_code if isinstance(e, gspread.exceptions.APIError) else None
+
+    @classmethod
+    def _transient(cls, e):
+        """Error koneksi/kuota/server (termasuk registry belum siap): bukan salah baris, cukup diulang nanti."""
+        status = cls._status(e)
+        return status == 429 or (status or 0) >= 500 or (status is None and isinstance(e, (OSError, RuntimeError)))
+
+    def _append(self, sheet_name, items, existing=None):
+        """Satu append_rows untuk items lalu menghapusnya dari jurnal. Mengembalikan jumlah baris tertulis.
+
+        existing: invoice yang sudah ada di sheet (dibaca sekali oleh pemanggil saat menulis per baris).
+        """
+        sheet = clients.sheet(sheet_name)
+        values = [i[1] for i in items]
+        if existing is None and any(i[2] > 0 for i in items):
+            # Percobaan sebelumnya mungkin sudah masuk sheet: lewati invoice yang sudah ada
+            existing = self._existing_invoices(sheet, values)
+        if existing:
+            values = [v for v in values if str(v[0]) not in existing]
+        start = time.monotonic()
+        if values:
+            with timed("append_rows"):
+                sheet.append_rows(values, value_input_option='USER_ENTERED')
+        self._finish([i[0] for i in items])
+        self.last_flush_latency, self.last_flush_at = time.monotonic() - start, datetime.now()
+        self._failures = 0
+        logger.info(f"Flush {len(values)} baris ke {sheet_name} dalam {self.last_flush_latency:.2f}s (sisa antrean: {self.depth()})")
+        return len(values)
+
+    def _failed(self, sheet_name, items, e):
+        """Menjadwalkan ulang items yang gagal; satu baris yang ditolak (400 atau terlalu sering) masuk dead letter."""
+        attempts, status = max(i[2] for i in items) + 1, self._status(e)
+        if len(items) == 1 and not self._transient(e) and (status == 400 or attempts >= self.DEAD_LETTER_AFTER_ATTEMPTS):
+            self._dead_letter(sheet_name, items[0], attempts, e)
+            return
+        delay = self._retry_later([i[0] for i in items], attempts)
+        logger.error(f"Gagal flush {len(items)} baris ke {sheet_name}{' (kuota)' if status == 429 else ''}, coba lagi dalam {delay}s: {e}")
+        # Hanya error koneksi/server yang dihitung untuk reconnect; error 4xx tidak sembuh dengan reconnect
+        if self._transient(e) and status != 429:
+            self._failures += 1
+            if self._failures >= self.RECONNECT_AFTER_FAILURES:
+                self._failures = 0
+                clients.reconnect()
+
+    def _dead_letter(self, sheet_name, item, attempts, e):
+        row_id, row, _ = item
+        with closing(_db()) as conn, conn:
+            conn.execute("""INSERT INTO write_dead_letter (id, sheet, row, created, attempts, failed, error)
+                SELECT id, sheet, row, created, ?, ?, ? FROM write_journal WHERE id = ?""", (attempts, time.time(), str(e)[:500], row_id))
+            conn.execute("DELETE FROM write_journal WHERE id = ?", (row_id,))
+        logger.error(f"Baris {row[0]} ke {sheet_name} gagal {attempts}x, dipindah ke write_dead_letter: {e}")
+        submit_async(send_msg(ADMIN_ID, f"Bot Error (Antrean Tulis): invoice {row[0]} tidak bisa ditulis ke {sheet_name} "
+                                        f"setelah {attempts}x percobaan, dipindah ke write_dead_letter.\n{str(e)[:300]}"))
+
+    def requeue_dead_letters(self):
+        """Mengembalikan semua baris dead letter ke jurnal (setelah penyebabnya diperbaiki). Mengembalikan jumlahnya."""
+        with closing(_db()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            moved = conn.execute("""INSERT INTO write_journal (sheet, row, created)
+                SELECT sheet, row, created FROM write_dead_letter ORDER BY id""").rowcount
+            conn.execute("DELETE FROM write_dead_letter")
+        if moved: self._wake.set()
+        return moved
+
+    def flush(self):
+        """Menulis satu batch dengan satu append_rows per worksheet. Mengembalikan jumlah baris tertulis.
+
+        Batch yang ditolak sheet ISOLATE_AFTER_ATTEMPTS kali (langsung jika 400) ditulis per baris;
+        error koneksi/kuota tidak memicu penulisan per baris.
+        """
+        rows = self._claim()
+        by_sheet = defaultdict(list)
+        for row_id, sheet_name, row, attempts in rows:
+            by_sheet[sheet_name].append((row_id, json.loads(row), attempts))
+
+        written = 0
+        for sheet_name, items in by_sheet.items():
+            try:
+                written += self._append(sheet_name, items)
+            except Exception as e:
+                if len(items) == 1 or self._transient(e) or \
+                        (self._status(e) != 400 and max(i[2] for i in items) + 1 < self.ISOLATE_AFTER_ATTEMPTS):
+                    self._failed(sheet_name, items, e)
+                    continue
+                logger.warning(f"Batch {len(items)} baris ke {sheet_name} ditolak, ditulis per baris: {e}")
+                try:
+                    existing = self._existing_invoices(clients.sheet(sheet_name), [i[1] for i in items])
+                except Exception as e:
+                    self._failed(sheet_name, items, e)
+                    continue
+                for n, item in enumerate(items):
+                    try:
+                        written += self._append(sheet_name, [item], existing)
+                    except Exception as e:
+                        self._failed(sheet_name, [item], e)
+                        if self._transient(e):  # sheet sedang bermasalah, sisa baris dicoba lagi nanti
+                            if items[n + 1:]: self._failed(sheet_name, items[n + 1:], e)
+                            break
+        return written
+
+    def _run(self):
+        while True:
+            self._wake.wait(WRITE_FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                while self.flush(): pass
+            except Exception as e:
+                logger.error(f"Writer antrean sheet error: {e}", exc_info=True)
+
+class ClosingArchive:
+    """Arsip SQLite untuk baris Closing/Closing MP dari bulan yang sudah ditutup.
+
+    Baris lama dipindahkan dari atas sheet (satu delete_rows per batch) agar sheet
+    tetap kecil. Jumlah baris yang sudah diarsip (offset) disimpan di shared_state
+    sehingga watermark lain (rollup, indeks duplikat) bisa memakai nomor baris
+    logis = offset + nomor baris fisik di sheet. Baris disimpan apa adanya (list nilai
+    sel), header saat diarsip disimpan terpisah di shared_state.
+    """
+
+    def __init__(self, sheet_names):
+        self.sheet_names = sheet_names
+        with closing(_db()) as conn, conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS closing_history (
+                sheet TEXT NOT NULL, row_no INTEGER NOT NULL, day TEXT, row TEXT NOT NULL, archived REAL NOT NULL,
+                PRIMARY KEY (sheet, row_no))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS closing_history_day ON closing_history (sheet, day)")
+
+    def layout(self, sheet_name):
+        """{'offset': baris yang sudah diarsip, 'busy': info batch jika sedang menghapus baris}."""
+        return shared_state.get(f"archive_layout:{sheet_name}", {'offset': 0, 'busy': None})
+
+    def offset(self, sheet_name):
+        return self.layout(sheet_name)['offset']
+
+    @staticmethod
+    def _positions(header):
+        """Nama header -> indeks kolom (kemunculan pertama, sama seperti iter_rows)."""
+        positions = {}
+        for i, name in enumerate(header): positions.setdefault(str(name).strip(), i)
+        return positions
+
+    @staticmethod
+    def _cell(values, positions, name):
+        i = positions.get(name)
+        return values[i] if i is not None and i < len(values) else ""
+
+    def _row_day(self, values, positions):
+        """Tanggal baris untuk batas arsip: TANGGAL INPUT, atau TANGGAL jika kosong/tidak valid."""
+        try:
+            return _input_day(self._cell(values, positions, "TANGGAL INPUT"))
+        except ValueError:
+            return _parse_sheet_date(self._cell(values, positions, "TANGGAL"))
+
+    def _recover(self, sheet, layout):
+        """Menuntaskan batch yang terputus: jika baris pertama batch masih ada berarti delete_rows belum terjadi."""
+        busy = layout['busy']
+        first = next(iter_rows(sheet, (0,), 2, 2), ("",))[0]
+        done = first != busy['first_invoice']
+        layout = {'offset': layout['offset'] + (busy['rows'] if done else 0), 'busy': None}
+        shared_state.set(f"archive_layout:{sheet.title}", layout)
+        logger.warning(f"Batch arsip {sheet.title} yang terputus {'diselesaikan' if done else 'dibatalkan'}.")
+        return layout
+
+    def _archive_batch(self, sheet, header, cutoff):
+        """Memindahkan maksimal ARCHIVE_BATCH_ROWS baris teratas sebelum cutoff. Mengembalikan jumlah baris."""
+        layout = self.layout(sheet.title)
+        if layout['busy']: layout = self._recover(sheet, layout)
+        positions = self._positions(header)
+        batch = []
+        for values in iter_rows(sheet, list(range(len(header))), 2, ARCHIVE_BATCH_ROWS + 1):
+            try:
+                if self._row_day(values, positions) >= cutoff: break
+            except ValueError:
+                break  # baris tanpa tanggal yang valid: berhenti agar tidak ikut terhapus
+            batch.append(list(values))
+        if not batch: return 0
+
+        offset, now = layout['offset'], time.time()
+        rows = []
+        for i, values in enumerate(batch):
+            try: day = _parse_sheet_date(self._cell(values, positions, "TANGGAL")).isoformat()
+            except ValueError: day = None
+            rows.append((sheet.title, offset + i + 1, day, json.dumps(values), now))
+        with closing(_db()) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO closing_history (sheet, row_no, day, row, archived) VALUES (?, ?, ?, ?, ?)", rows)
+
+        key = f"archive_layout:{sheet.title}"
+        shared_state.set(key, {'offset': offset, 'busy': {'rows': len(batch), 'first_invoice': batch[0][0]}})
+        # delete_rows menghapus berdasarkan posisi: pastikan baris 2..N+1 masih baris yang baru disalin
+        # (sheet bisa diurutkan/disisipi baris oleh staf selama batch dibaca)
+        current = [values[0] for values in iter_rows(sheet, (0,), 2, len(batch) + 1)]
+        current += [""] * (len(batch) - len(current))  # sel kosong di akhir range tidak dikembalikan API
+        if current != [values[0] for values in batch]:
+            with closing(_db()) as conn, conn:
+                conn.execute("DELETE FROM closing_history WHERE sheet = ? AND row_no > ?", (sheet.title, offset))
+            shared_state.set(key, {'offset': offset, 'busy': None})
+            raise RuntimeError(f"Baris {sheet.title} berubah saat diarsip (invoice tidak cocok), batch dibatalkan")
+        sheet.delete_rows(2, len(batch) + 1)
+        shared_state.set(key, {'offset': offset + len(batch), 'busy': None})
+        return len(batch)
+
+    def archive(self, keep_months=ARCHIVE_KEEP_MONTHS):
+        """Memindahkan semua baris sebelum awal bulan ke-(keep_months - 1) yang lalu ke arsip."""
+        today = date.today()
+        month = today.year * 12 + today.month - 1 - (keep_months - 1)
+        cutoff = date(month // 12, month % 12 + 1, 1)
+        for sheet_name in self.sheet_names:
+            sheet = clients.sheet(sheet_name)
+            header = sheet.row_values(1)
+            stored = shared_state.get(f"archive_header:{sheet_name}")
+            if stored != header: invalidate_headers(sheet.title)  # posisi kolom yang di-cache iter_rows mungkin sudah bergeser
+            if stored is not None and stored != header and self.offset(sheet_name):
+                logger.error(f"Arsip {sheet_name} dilewati: header sheet berubah sejak arsip terakhir.")
+                continue
+            shared_state.set(f"archive_header:{sheet_name}", header)
+            total = 0
+            while True:
+                moved = self._archive_batch(sheet, header, cutoff)
+                total += moved
+                if moved < ARCHIVE_BATCH_ROWS: break
+            if total: logger.info(f"Arsip {sheet_name}: {total} baris sebelum {cutoff:%d/%m/%Y} dipindahkan.")
+
+    def records(self, sheet_name, columns=None, start=None, end=None):
+        """Yield tuple baris arsip (urut sesuai sheet), opsional difilter TANGGAL dalam [start, end].
+
+        columns: nama header saat diarsip atau indeks 0-based (format sama dengan iter_rows); None = semua kolom.
+        """
+        positions = self._positions(shared_state.get(f"archive_header:{sheet_name}", []))
+        indexes = None if columns is None else [c if isinstance(c, int) else positions.get(c) for c in columns]
+        query, params = "SELECT row FROM closing_history WHERE sheet = ?", [sheet_name]
+        if start: query += " AND day >= ?"; params.append(start.isoformat())
+        if end: query += " AND day <= ?"; params.append(end.isoformat())
+        with closing(_db()) as conn:
+            for (row,) in conn.execute(query + " ORDER BY row_no", params):
+                values = json.loads(row)
+                if indexes is None: yield tuple(values)
+                else: yield tuple(str(values[i]) if i is not None and i < len(values) else "" for i in indexes)
+
+class DupIndex:
+    """Indeks duplikat agar cek duplikat tidak membaca sheet: no HP hari ini (exact) dan
+    alamat mirip (normalisasi + MinHash per kecamatan & kota/kab) dalam ADDRESS_DUP_DAYS hari."""
+
+    COLUMNS = ("INVOICE", "WHATSAPP", "ALAMAT", "TANGGAL INPUT", "KECAMATAN", "KOTA/KAB")
+    # INVOICE, KECAMATAN & KOTA/KAB dibaca dari posisi kolom build_row, bukan dari nama header
+    SHEET_COLUMNS = (ROW_COLUMNS["INVOICE"], "WHATSAPP", "ALAMAT", "TANGGAL INPUT", ROW_COLUMNS["KECAMATAN"], ROW_COLUMNS["KOTA/KAB"])
+
+    def __init__(self, sheet_name):
+        self.sheet_name = sheet_name
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._day = None
+        self._phones = {}  # no HP ternormalisasi -> WHATSAPP asli (hari ini)
+        self._addresses = AddressIndex(ADDRESS_DUP_THRESHOLD)
+        self._folded = set()  # (hari, jenis, key) reservasi SQLite yang sudah masuk indeks memori
+        self._synced_rows = 0  # jumlah baris data sheet yang sudah dibaca
+        self._synced_invoice = None  # invoice baris terakhir yang sudah dibaca, untuk mendeteksi baris yang bergeser
+        self._ready = False
+        with closing(_db()) as conn, conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS dup_reservations (
+                sheet TEXT NOT NULL, day TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, whatsapp TEXT,
+                PRIMARY KEY (sheet, day, kind, key))""")
+            if 'owner' not in {r[1] for r in conn.execute("PRAGMA table_info(dup_reservations)")}:
+                conn.execute("ALTER TABLE dup_reservations ADD COLUMN owner TEXT")  # update_id pemesan
+
+    @staticmethod
+    def _window():
+        """Hari-hari dalam jendela cek alamat, mulai hari ini."""
+        today = date.today()
+        return [today - timedelta(days=i) for i in range(ADDRESS_DUP_DAYS)]
+
+    @staticmethod
+    def _addr_key(addr, kecamatan, kota_kab):
+        """Key alamat untuk reservasi SQLite: 'kecamatan|kota|alamat ternormalisasi' ('' jika alamat kosong)."""
+        normalized = normalize_address(addr)
+        return "|".join((normalize_region(kecamatan), normalize_region(kota_kab), normalized)) if normalized else ""
+
+    def _roll_day(self):
+        """Saat berganti hari: kosongkan no HP & buang alamat di luar jendela (dipanggil dengan lock)."""
         today_str = datetime.now().strftime("%d/%m/%Y")
-        all_data = sheet.get_all_records()
-        for row in all_data:
-            if str(row.get("TANGGAL INPUT", "")).startswith(today_str):
-                row_phone = format_phone_number(row.get("WHATSAPP"))
-                row_addr = str(row.get("ALAMAT", "")).strip().lower()
-                if row_phone == phone or row_addr == addr.lower():
-                    return f"Duplicate: {row.get('WHATSAPP')}"
-        return False
+        if self._day != today_str:
+            window = self._window()
+            self._day, self._phones = today_str, {}
+            self._addresses.prune(window[-1])
+            days = {d.strftime("%d/%m/%Y") for d in window}
+            self._folded = {f for f in self._folded if f[0] in days}
+        return today_str
+
+    def _put(self, phone, addr, kecamatan, kota_kab, raw, day):
+        if phone and day == date.today(): self._phones.setdefault(phone, raw)
+        if addr: self._addresses.add(addr, kecamatan, kota_kab, raw, day)
+
+    def _fold(self, reserved):
+        """Memasukkan reservasi worker lain (SQLite) ke indeks memori agar ikut dicek secara fuzzy."""
+        for day_str, kind, key, raw in reserved:
+            if (day_str, kind, key) in self._folded: continue
+            self._folded.add((day_str, kind, key))
+            try: day = _parse_sheet_date(day_str)
+            except ValueError: continue
+            if kind == 'phone':
+                self._put(key, "", "", "", raw, day)
+            else:
+                kecamatan, kota_kab, addr = key.split("|", 2)
+                self._put("", addr, kecamatan, kota_kab, raw, day)
+
+    def _shared(self, day, phone, addr_key, raw, reserve, owner=None):
+        """Cek (dan klaim) atomik di SQLite agar pesanan yang lolos di worker lain ikut terlihat.
+
+        reserve=False hanya cek, True cek lalu klaim, None klaim tanpa cek.
+        """
+        window = [d.strftime("%d/%m/%Y") for d in self._window()]
+        keys = [(kind, key) for kind, key in (('phone', phone), ('addr', addr_key)) if key]
+        with closing(_db()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if reserve is not None:
+                for kind, key in keys:
+                    days = window if kind == 'addr' else window[:1]
+                    row = conn.execute(f"""SELECT whatsapp FROM dup_reservations WHERE sheet = ? AND kind = ? AND key = ?
+                        AND day IN ({','.join('?' * len(days))})""", (self.sheet_name, kind, key, *days)).fetchone()
+                    if row: return row[0]
+            if reserve is not False:
+                conn.executemany("INSERT OR IGNORE INTO dup_reservations (sheet, day, kind, key, whatsapp, owner) VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(self.sheet_name, day, kind, key, raw, owner) for kind, key in keys])
+        return None
+
+    def _owned(self, owner):
+        """True jika update `owner` sudah pernah lolos cek & mengklaim reservasi (percobaan sebelum crash)."""
+        with closing(_db()) as conn:
+            return conn.execute("SELECT 1 FROM dup_reservations WHERE sheet = ? AND owner = ? LIMIT 1",
+                                (self.sheet_name, owner)).fetchone() is not None
+
+    def _reserve_local(self, day, phone, addr, kecamatan, kota_kab, addr_key, raw):
+        with self._lock:
+            self._put(phone, addr, kecamatan, kota_kab, raw, date.today())
+            self._folded.update({(day, 'phone', phone), (day, 'addr', addr_key)})
+
+    def add(self, phone, addr, raw=None, kecamatan="", kota_kab="", owner=None):
+        """Mencatat pesanan hari ini yang lolos tanpa cek (mis. #ro)."""
+        phone, addr_key = format_phone_number(phone), self._addr_key(addr, kecamatan, kota_kab)
+        with self._lock:
+            day = self._roll_day()
+        self._reserve_local(day, phone, addr, kecamatan, kota_kab, addr_key, raw or phone)
+        self._shared(day, phone, addr_key, raw or phone, reserve=None, owner=owner)
+
+    def sync(self):
+        """Membaca hanya baris yang ditambahkan sejak sinkronisasi terakhir (build pertama: mulai awal jendela alamat).
+
+        Baris terakhir yang sudah dibaca ikut dibaca ulang; jika invoice-nya berbeda (baris dihapus/disisipkan
+        manual), indeks dibangun ulang dari awal jendela alamat.
+        """
+        with self._sync_lock:
+            sheet = clients.sheet(self.sheet_name)
+            layout = closing_archive.layout(self.sheet_name)
+            if layout['busy']: return  # arsip sedang menghapus baris, coba di sinkron berikutnya
+            offset = layout['offset']
+            oldest = self._window()[-1]
+            mark_row = self._synced_rows - offset + 1
+            rebuild = not self._ready
+            if self._ready and self._synced_invoice is not None and mark_row >= 2:
+                records = list(iter_rows(sheet, self.SHEET_COLUMNS, mark_row))
+                if records and records[0][0] == self._synced_invoice:
+                    start, records = mark_row + 1, records[1:]
+                else:
+                    logger.warning(f"Indeks duplikat {self.sheet_name}: invoice di baris {mark_row} bukan {self._synced_invoice}, dibangun ulang.")
+                    rebuild = True
+            elif self._ready:
+                start = max(2, mark_row + 1)
+                records = list(iter_rows(sheet, self.SHEET_COLUMNS, start))
+            if rebuild:
+                start = _first_row_since(sheet, oldest)
+                records = list(iter_rows(sheet, self.SHEET_COLUMNS, start))
+            if closing_archive.layout(self.sheet_name) != layout: return
+            pending = write_queue.pending_rows(self.sheet_name, self.COLUMNS)
+            with closing(_db()) as conn:
+                reserved = conn.execute("SELECT day, kind, key, whatsapp FROM dup_reservations WHERE sheet = ?", (self.sheet_name,)).fetchall()
+            with self._lock:
+                if rebuild and self._ready:  # buang entri dari baris yang sudah tidak ada; reservasi dilipat ulang di bawah
+                    self._phones, self._addresses, self._folded = {}, AddressIndex(ADDRESS_DUP_THRESHOLD), set()
+                self._roll_day()
+                for _, raw, addr, input_at, kecamatan, kota_kab in records + pending:
+                    try: day = _input_day(input_at)
+                    except ValueError: continue
+                    if day >= oldest: self._put(format_phone_number(raw), addr, kecamatan, kota_kab, raw, day)
+                self._fold(reserved)
+                self._synced_rows = offset + start - 2 + len(records)  # nomor baris logis
+                if records or rebuild: self._synced_invoice = records[-1][0] if records else None
+                self._ready = True
+            days = [d.strftime("%d/%m/%Y") for d in self._window()]
+            with closing(_db()) as conn, conn:
+                conn.execute(f"DELETE FROM dup_reservations WHERE sheet = ? AND day NOT IN ({','.join('?' * len(days))})", (self.sheet_name, *days))
+            if records:
+                logger.info(f"Indeks duplikat {self.sheet_name}: {len(records)} baris baru disinkronkan.")
+
+    def check(self, phone, addr, reserve=False, kecamatan="", kota_kab="", owner=None, retry=False):
+        """Cek duplikat tanpa panggilan jaringan (kecuali build pertama): no HP sama hari ini,
+        atau alamat mirip di kecamatan & kota/kab yang sama dalam jendela ADDRESS_DUP_DAYS.
+
+        Dengan reserve=True, pesanan yang lolos langsung dicatat secara atomik
+        sehingga dua pesanan sama yang diproses bersamaan tidak lolos dua-duanya.
+        Dengan retry=True (update diulang dari inbox), reservasi milik `owner` sendiri bukan duplikat.
+        """
+        if retry and owner and self._owned(owner): return False
+        if not self._ready: self.sync()
+        addr_key = self._addr_key(addr, kecamatan, kota_kab)
+        with self._lock:
+            day = self._roll_day()
+            raw = self._phones.get(phone) or self._addresses.find(addr, kecamatan, kota_kab)
+        if not raw:
+            raw = self._shared(day, phone, addr_key, phone, reserve, owner)
+            if not raw and reserve: self._reserve_local(day, phone, addr, kecamatan, kota_kab, addr_key, phone)
+        return f"Duplicate: {raw}" if raw else False
+
+@timed("is_dup_phone")
+def is_dup_phone(phone, addr, index, kecamatan="", kota_kab="", owner=None, retry=False):
+    """Cek duplikat lalu mencatat pesanan yang lolos ke indeks."""
+    try:
+        return index.check(phone, addr, reserve=True, kecamatan=kecamatan, kota_kab=kota_kab, owner=owner, retry=retry)
     except Exception as e:
         logger.error(f"Error saat cek duplikat: {e}")
         return False
 
+class DailyStats:
+    """Agregat harian per CUSTOMER SERVICE (invoice, box, sachet) di SQLite bersama, diperbarui saat baris ditulis."""
+
+    COLUMNS = ("CUSTOMER SERVICE", "QTY BOX", "QTY SACHET", "TANGGAL INPUT")
+
+    def __init__(self, sheet_names):
+        self.sheet_names = sheet_names
+        self._seed_lock = threading.RLock()
+        self._day = None
+        with closing(_db()) as conn, conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT NOT NULL, cs TEXT NOT NULL, invoices INTEGER NOT NULL, box INTEGER NOT NULL,
+                sachet INTEGER NOT NULL, PRIMARY KEY (day, cs))""")
+            conn.execute("CREATE TABLE IF NOT EXISTS daily_stats_seeded (day TEXT PRIMARY KEY)")
+
+    @staticmethod
+    def _seeded(conn, day):
+        return conn.execute("SELECT 1 FROM daily_stats_seeded WHERE day = ?", (day,)).fetchone() is not None
+
+    def seed(self):
+        """Membaca sekali semua sheet untuk mengisi agregat hari ini; dilewati jika worker lain sudah mengisinya."""
+        with self._seed_lock:  # RLock: boleh dipanggil dari ensure_day
+            today_str = datetime.now().strftime("%d/%m/%Y")
+            with closing(_db()) as conn:
+                if self._seeded(conn, today_str):
+                    self._day = today_str
+                    return
+            by_cs = defaultdict(lambda: {'invoices': 0, 'box': 0, 'sachet': 0})
+            for sheet_name in self.sheet_names:
+                try:
+                    sheet = clients.sheet(sheet_name)
+                    rows = iter_rows(sheet, self.COLUMNS, _first_row_since(sheet, date.today()))
+                    for cs, box, sachet, input_at in chain(rows, write_queue.pending_rows(sheet_name, self.COLUMNS)):
+                        if input_at.startswith(today_str):
+                            stats = by_cs[cs]
+                            stats['invoices'] += 1
+                            stats['box'] += int(box or 0)
+                            stats['sachet'] += int(sachet or 0)
+                except Exception as e:
+                    logger.error(f"Gagal mengambil stats dari {sheet_name}: {e}")
+            with closing(_db()) as conn, conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if not self._seeded(conn, today_str):
+                    conn.execute("DELETE FROM daily_stats WHERE day != ?", (today_str,))
+                    conn.execute("DELETE FROM daily_stats_seeded WHERE day != ?", (today_str,))
+                    conn.executemany("INSERT OR REPLACE INTO daily_stats (day, cs, invoices, box, sachet) VALUES (?, ?, ?, ?, ?)",
+                                     [(today_str, cs, v['invoices'], v['box'], v['sachet']) for cs, v in by_cs.items()])
+                    conn.execute("INSERT INTO daily_stats_seeded (day) VALUES (?)", (today_str,))
+                    logger.info(f"Stats harian {today_str} dimuat untuk {len(by_cs)} CS.")
+            self._day = today_str
+
+    def ensure_day(self):
+        """Memastikan agregat hari ini sudah di-seed; mengembalikan hari yang dipakai.
+
+        Dipanggil sebelum baris dijurnal: seed menghitung baris di jurnal, jadi baris yang masuk
+        jurnal sebelum seed tidak boleh ditambahkan lagi lewat add().
+        """
+        if self._day != datetime.now().strftime("%d/%m/%Y"):
+            with self._seed_lock:
+                if self._day != datetime.now().strftime("%d/%m/%Y"):
+                    self.seed()
+        return self._day
+
+    def add(self, cs_name, box, sachet, day):
+        """Mencatat satu invoice baru untuk CS; day dari ensure_day() sebelum baris dijurnal.
+
+        Dilewati jika hari sudah berganti sejak itu (seed hari baru sudah menghitung baris dari jurnal/sheet).
+        """
+        if day != self._day: return
+        with closing(_db()) as conn, conn:
+            conn.execute("""INSERT INTO daily_stats (day, cs, invoices, box, sachet) VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT (day, cs) DO UPDATE SET invoices = invoices + 1,
+                box = box + excluded.box, sachet = sachet + excluded.sachet""",
+                (self._day, cs_name, int(box or 0), int(sachet or 0)))
+
+    def get(self, cs_name=None):
+        self.ensure_day()
+        query = "SELECT SUM(invoices), SUM(box), SUM(sachet) FROM daily_stats WHERE day = ?"
+        with closing(_db()) as conn:
+            row = conn.execute(query + " AND cs = ?", (self._day, cs_name)).fetchone() if cs_name \
+                else conn.execute(query, (self._day,)).fetchone()
+        return {k: v or 0 for k, v in zip(('invoices', 'box', 'sachet'), row)}
+
+class SalesRollup:
+    """Rollup penjualan per hari & CS di SQLite, diperbarui hanya dari baris baru.
+
+    High-water mark berupa jumlah baris plus invoice di baris itu; jika invoice di posisi tersebut
+    berubah (baris di atasnya dihapus/disisipkan manual), rollup dibangun ulang.
+    """
+
+    # Kolom A (invoice) + kolom yang dijumlahkan
+    COLUMNS = (0, "TANGGAL", "CUSTOMER SERVICE", "QTY BOX", "QTY SACHET")
+
+    def __init__(self, sheet_names):
+        self.sheet_names = sheet_names
+        with closing(_db()) as conn, conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS sales_rollup (
+                day TEXT NOT NULL, cs TEXT NOT NULL, box INTEGER NOT NULL, sachet INTEGER NOT NULL,
+                invoices INTEGER NOT NULL, PRIMARY KEY (day, cs))""")
+            conn.execute("CREATE TABLE IF NOT EXISTS rollup_watermark (sheet TEXT PRIMARY KEY, rows INTEGER NOT NULL)")
+            if 'invoice' not in {r[1] for r in conn.execute("PRAGMA table_info(rollup_watermark)")}:
+                conn.execute("ALTER TABLE rollup_watermark ADD COLUMN invoice TEXT")  # invoice di baris watermark
+
+    def _watermark(self, conn, sheet_name):
+        """(jumlah baris, invoice baris terakhir) yang sudah masuk rollup."""
+        row = conn.execute("SELECT rows, invoice FROM rollup_watermark WHERE sheet = ?", (sheet_name,)).fetchone()
+        return row if row else (0, None)
+
+    @staticmethod
+    def _bucket(rows, invoice=None):
+        """Mengelompokkan tuple COLUMNS per (hari, CS). Mengembalikan (buckets, jumlah baris dibaca, invoice terakhir)."""
+        buckets = defaultdict(lambda: [0, 0, 0])
+        read = 0
+        for invoice, tanggal, cs, box, sachet in rows:
+            read += 1
+            try:
+                day = _parse_sheet_date(tanggal).isoformat()
+                cs = cs.replace("DOORASI ", "").strip() or "Unknown"
+                box, sachet = int(box or 0), int(sachet or 0)
+            except (ValueError, TypeError): continue
+            bucket = buckets[(day, cs)]
+            bucket[0] += box; bucket[1] += sachet; bucket[2] += 1
+        return buckets, read, invoice
+
+    def _commit(self, sheet_name, synced, buckets, watermark, invoice):
+        with closing(_db()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if self._watermark(conn, sheet_name)[0] != synced:
+                logger.warning(f"Rollup {sheet_name} sudah diperbarui proses lain, dilewati.")
+                return
+            conn.executemany("""INSERT INTO sales_rollup (day, cs, box, sachet, invoices) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (day, cs) DO UPDATE SET box = box + excluded.box,
+                sachet = sachet + excluded.sachet, invoices = invoices + excluded.invoices""",
+                [(day, cs, *vals) for (day, cs), vals in buckets.items()])
+            conn.execute("INSERT OR REPLACE INTO rollup_watermark (sheet, rows, invoice) VALUES (?, ?, ?)",
+                         (sheet_name, watermark, invoice))
+
+    def update(self):
+        """Menambahkan baris sejak high-water mark (nomor baris logis, termasuk yang sudah diarsip) ke bucket harian."""
+        for sheet_name in self.sheet_names:
+            with closing(_db()) as conn:
+                synced, invoice = self._watermark(conn, sheet_name)
+            layout = closing_archive.layout(sheet_name)
+            if layout['busy']:
+                logger.warning(f"Rollup {sheet_name} dilewati: arsip sedang berjalan.")
+                continue
+            if synced < layout['offset']:
+                logger.warning(f"Rollup {sheet_name} tertinggal dari arsip, dibangun ulang.")
+                self.rebuild()
+                return
+            mark_row = synced - layout['offset'] + 1  # baris sheet terakhir yang sudah dihitung (1 = header)
+            verify = invoice is not None and mark_row >= 2
+            rows = iter_rows(clients.sheet(sheet_name), self.COLUMNS, mark_row if verify else mark_row + 1)
+            if verify and (next(rows, None) or ("",))[0] != invoice:
+                logger.warning(f"Rollup {sheet_name}: invoice di baris {mark_row} bukan {invoice} (baris dihapus/disisipkan?), dibangun ulang.")
+                self.rebuild()
+                return
+            buckets, read, last = self._bucket(rows, invoice)
+            if closing_archive.layout(sheet_name) != layout:
+                logger.warning(f"Rollup {sheet_name} dilewati: baris berpindah ke arsip saat dibaca.")
+                continue
+            self._commit(sheet_name, synced, buckets, synced + read, last)
+            if read:
+                logger.info(f"Rollup {sheet_name}: {read} baris baru diproses.")
+
+    def rebuild(self):
+        """Menghapus seluruh rollup lalu membangun ulang dari arsip dan awal sheet."""
+        with closing(_db()) as conn, conn:
+            conn.execute("DELETE FROM sales_rollup")
+            conn.execute("DELETE FROM rollup_watermark")
+        for sheet_name in self.sheet_names:
+            buckets, read, last = self._bucket(closing_archive.records(sheet_name, self.COLUMNS))
+            self._commit(sheet_name, 0, buckets, read, last)
+        self.update()
+
+    def totals(self, start, end):
+        """Total per CS ({'b', 's', 'i'}) untuk rentang tanggal [start, end]."""
+        with closing(_db()) as conn:
+            rows = conn.execute("""SELECT cs, SUM(box), SUM(sachet), SUM(invoices) FROM sales_rollup
+                WHERE day BETWEEN ? AND ? GROUP BY cs""", (start.isoformat(), end.isoformat())).fetchall()
+        return {cs: {'b': b, 's': s, 'i': i} for cs, b, s, i in rows}
+
+@timed("get_combined_stats")
 def get_combined_stats(cs_name=None):
-    stats = {'invoices': 0, 'box': 0, 'sachet': 0}
-    today_str = datetime.now().strftime("%d/%m/%Y")
-    for sheet in [closing_sheet, closing_mp_sheet]:
-        try:
-            for row in sheet.get_all_records():
-                if str(row.get("TANGGAL INPUT", "")).startswith(today_str):
-                    if not cs_name or row.get("CUSTOMER SERVICE", "") == cs_name:
-                        stats['invoices'] += 1
-                        stats['box'] += int(row.get("QTY BOX", 0) or 0)
-                        stats['sachet'] += int(row.get("QTY SACHET", 0) or 0)
-        except Exception as e:
-            logger.error(f"Gagal mengambil stats dari {sheet.title}: {e}")
-    return stats
+    return daily_stats.get(cs_name)
+
+# State berbasis worksheet; worksheet diambil dari registry saat dipakai
+write_queue = WriteBehindQueue()
+closing_archive = ClosingArchive([SHEET_CLOSING, SHEET_CLOSING_MP])
+closing_dup_index = DupIndex(SHEET_CLOSING)
+agent_codes = AgentCodeCache(SHEET_AGEN)
+sales_rollup = SalesRollup([SHEET_CLOSING, SHEET_CLOSING_MP])
+daily_stats = DailyStats([SHEET_CLOSING, SHEET_CLOSING_MP])
+
+metrics.gauge("write_queue_depth", "Baris yang masih antre ditulis ke sheet", write_queue.depth)
+metrics.gauge("write_queue_dead_letters", "Baris yang ditolak sheet dan menunggu requeue-dead-letters", write_queue.dead_letters)
+metrics.gauge("write_queue_last_flush_seconds", "Durasi flush terakhir ke sheet", lambda: write_queue.last_flush_latency)
+metrics.gauge("telegram_outbound_queue_depth", "Pesan Telegram yang masih antre", lambda: dispatcher.depth())
+metrics.gauge("agent_cache_codes", "Jumlah kode agen di cache", lambda: len(agent_codes.codes))
+metrics.gauge("agent_cache_events", "Hit/miss/refresh cache kode agen (kumulatif)", lambda: dict(agent_codes.metrics))
+metrics.gauge("dup_index_entries", "Entri indeks duplikat (no HP hari ini, alamat dalam jendela)", lambda: {'phones': len(closing_dup_index._phones), 'addrs': len(closing_dup_index._addresses)})
+metrics.gauge("closing_archived_rows", "Baris Closing yang sudah dipindah ke arsip SQLite", lambda: {n: closing_archive.offset(n) for n in closing_archive.sheet_names})
+metrics.gauge("clients_ready", "1 jika koneksi Telegram & Sheets siap", lambda: int(clients.ready))
+
+# Pemanasan setelah koneksi siap: buang cache header (kolom mungkin diubah selama terputus),
+# indeks duplikat, stats harian, cache agen & writer antrean
+for _warm_up in (invalidate_headers, closing_dup_index.sync, daily_stats.seed, agent_codes.refresh, write_queue.start):
+    clients.on_ready(_warm_up)
+clients.start()
 
 # ==================================================
 # ♠️ Fungsi Notifikasi & Laporan (Terjadwal)
 # ==================================================
-def _load_message_ids():
-    """Membaca ID pesan dari file JSON."""
-    if not os.path.exists(MESSAGE_ID_STORE_PATH):
-        return {}
-    with open(MESSAGE_ID_STORE_PATH, 'r') as f:
-        return json.load(f)
-
-def _save_message_ids(data):
-    """Menyimpan ID pesan ke file JSON."""
-    with open(MESSAGE_ID_STORE_PATH, 'w') as f:
-        json.dump(data, f)
+# Pool untuk merender bagian laporan secara paralel (query rollup/cache berjalan di thread)
+_report_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="report")
+
+def render_sections(builders):
+    """Menjalankan builder bagian laporan secara paralel; hasil tetap berurutan sesuai builders."""
+    return [future.result() for future in [_report_pool.submit(build) for build in builders]]
+
+def chunk_lines(lines, limit=TG_MAX_MESSAGE_LEN):
+    """Menggabungkan baris menjadi potongan pesan <= limit karakter tanpa memotong baris (kecuali baris itu sendiri terlalu panjang)."""
+    chunks, current, size = [], [], 0
+    for line in lines:
+        while len(line) > limit:  # baris tunggal yang terlalu panjang dipotong paksa
+            if current: chunks.append("\n".join(current)); current, size = [], 0
+            chunks.append(line[:limit]); line = line[limit:]
+        if current and size + 1 + len(line) > limit:
+            chunks.append("\n".join(current)); current, size = [], 0
+        size += len(line) + (1 if current else 0)
+        current.append(line)
+    if current: chunks.append("\n".join(current))
+    return [c for c in chunks if c.strip()]
+
+async def publish_report(chat_id, thread_id, store_key, chunks):
+    """Menghapus potongan laporan lama (satu delete_messages), mengirim potongan baru, dan menyimpan semua ID-nya.
+
+    Semua potongan diantrekan sekaligus; antrean per thread di dispatcher menjaga urutannya.
+    """
+    old_ids = shared_state.get(store_key) or []
+    if not isinstance(old_ids, list): old_ids = [old_ids]  # format lama: satu ID
+    await delete_msgs(chat_id, old_ids)
+
+    results = await asyncio.gather(*[dispatcher.call(chat_id, 'send_message', chat_id=chat_id, text=chunk, message_thread_id=thread_id)
+                                     for chunk in chunks], return_exceptions=True)
+    ids = [r.message_id for r in results if not isinstance(r, BaseException)]
+    await asyncio.to_thread(shared_state.set, store_key, ids)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if failed: raise RuntimeError(f"{len(failed)}/{len(chunks)} potongan {store_key} gagal terkirim: {failed[0]}")
+    return ids
 
 def send_available_agents():
-    """Mengirim daftar agen yang tersedia (padanan sendAvailableAgents)."""
+    """Mengirim daftar agen yang tersedia (padanan sendAvailableAgents), dipecah per 4096 karakter seperti di GAS."""
     logger.info("Menjalankan tugas: Mengirim daftar agen.")
     try:
-        agents = agen_sheet.col_values(2)[1:]
-        agents = sorted([agent.strip() for agent in agents if agent and agent.strip()])
+        agent_codes.refresh()
+        agents = sorted(agent_codes.snapshot())
         if not agents:
-            send_msg(AGENT_NOTIF_GROUP_ID, "🚨 Tidak ada agen yang tersedia di sheet 'AGEN'!", AGENT_NOTIF_THREAD_ID)
+            run_async(send_msg(AGENT_NOTIF_GROUP_ID, "🚨 Tidak ada agen yang tersedia di sheet 'AGEN'!", AGENT_NOTIF_THREAD_ID))
             return
 
         date_str = format_date(datetime.now(), "EEEE, dd MMMM yyyy")
-        header = f"📋 Daftar Agen Tersedia\n📅 Tanggal: {date_str}\n\n"
-        agent_lines = [f"{i+1}. {agent}" for i, agent in enumerate(agents)]
-        total = f"\nTotal: {len(agents)} Agen"
-        
-        # Hapus pesan lama
-        store = _load_message_ids()
-        old_ids = store.get('agent_notif_ids', [])
-        for msg_id in old_ids:
-            delete_msg(AGENT_NOTIF_GROUP_ID, msg_id)
-
-        # Kirim pesan baru (untuk simpel, tidak dipecah seperti di GAS)
-        full_message = header + "\n".join(agent_lines) + total
-        msg = bot.send_message(chat_id=AGENT_NOTIF_GROUP_ID, text=full_message, message_thread_id=AGENT_NOTIF_THREAD_ID)
-        
-        # Simpan ID pesan baru
-        store['agent_notif_ids'] = [msg.message_id]
-        _save_message_ids(store)
+        lines = [f"📋 Daftar Agen Tersedia\n📅 Tanggal: {date_str}\n"]
+        lines += [f"{i+1}. {agent}" for i, agent in enumerate(agents)]
+        lines.append(f"\nTotal: {len(agents)} Agen")
+
+        chunks = chunk_lines(lines)
+        run_async(publish_report(AGENT_NOTIF_GROUP_ID, AGENT_NOTIF_THREAD_ID, 'agent_notif_ids', chunks))
+        logger.info(f"Daftar {len(agents)} agen terkirim dalam {len(chunks)} pesan.")
     except Exception as e:
         logger.error(f"Gagal mengirim daftar agen: {e}", exc_info=True)
-        send_msg(ADMIN_ID, f"Bot Error (Send Agents): {e}")
+        run_async(send_msg(ADMIN_ID, f"Bot Error (Send Agents): {e}"))
         
 def send_sales_report():
     """Mengirim laporan penjualan harian/mingguan/bulanan (padanan sendSalesReport)."""
@@ -300,26 +1817,12 @@ def send_sales_report():
         week_start = today - timedelta(days=6) # 7 hari terakhir termasuk hari ini
         month_start = today.replace(day=1)
 
-        daily_stats, weekly_stats, monthly_stats = defaultdict(lambda: {'b': 0, 's': 0, 'i': 0}), defaultdict(lambda: {'b': 0, 's': 0, 'i': 0}), defaultdict(lambda: {'b': 0, 's': 0, 'i': 0})
-        
-        for sheet in [closing_sheet, closing_mp_sheet]:
-            for row in sheet.get_all_records():
-                try:
-                    row_date = datetime.strptime(str(row.get("TANGGAL", "")), "%d/%m/%Y").date()
-                    cs = str(row.get("CUSTOMER SERVICE", "Unknown")).replace("DOORASI ", "").strip()
-                    box = int(row.get("QTY BOX", 0) or 0)
-                    sachet = int(row.get("QTY SACHET", 0) or 0)
-
-                    if row_date == today:
-                        daily_stats[cs]['b'] += box; daily_stats[cs]['s'] += sachet; daily_stats[cs]['i'] += 1
-                    if week_start <= row_date <= today:
-                        weekly_stats[cs]['b'] += box; weekly_stats[cs]['s'] += sachet; weekly_stats[cs]['i'] += 1
-                    if month_start <= row_date <= today:
-                        monthly_stats[cs]['b'] += box; monthly_stats[cs]['s'] += sachet; monthly_stats[cs]['i'] += 1
-                except (ValueError, TypeError): continue
-        
-        def format_rank_section(title, stats_dict, period_str=""):
-            if not stats_dict: return f"{title} {period_str}\nTidak ada data.\n\n"
+        sales_rollup.update()
+
+        def format_rank_section(title, start, end, period_str=""):
+            """Baris satu bagian peringkat; dipanggil paralel dari render_sections."""
+            stats_dict = sales_rollup.totals(start, end)
+            if not stats_dict: return [f"{title} {period_str}", "Tidak ada data.", ""]
             
             total = {'b': 0, 's': 0, 'i': 0}
             ranked_list = []
@@ -333,27 +1836,25 @@ def send_sales_report():
             
             lines = [f"{i+1}. {d['n']} | {d['b']} Box - {d['s']} Sachet ({d['i']} Inv)" for i, d in enumerate(ranked_list)]
             total_line = f"TOTAL: {total['i']} Invoice | {total['b']} Box | {total['s']} Sachet"
-            return f"{title} {period_str}\n" + "\n".join(lines) + f"\n{total_line}\n\n"
+            return [f"{title} {period_str}", *lines, total_line, ""]
 
         today_str = format_date(datetime.now(), "dd/MM/yyyy")
-        msg = f"🏆 Laporan Penjualan CS\n📅 Tanggal: {format_date(datetime.now(), 'EEEE, dd MMMM yyyy')}\n\n"
-        msg += format_rank_section("▶︎ Daily", daily_stats, f"({today_str})")
-        msg += format_rank_section("▶︎ Mingguan (7 Hari Terakhir)", weekly_stats, f"({format_date(week_start, 'dd/MM/yyyy')} - {today_str})")
-        msg += format_rank_section(f"▶︎ Bulanan ({month_name[today.month]})", monthly_stats)
-
-        # Hapus pesan lama dan kirim yang baru
-        store = _load_message_ids()
-        today_key = f"sales_report_{today.isoformat()}"
-        old_id = store.get(today_key)
-        if old_id: delete_msg(SALES_GRP_ID, old_id)
+        sections = render_sections([
+            lambda: format_rank_section("▶︎ Daily", today, today, f"({today_str})"),
+            lambda: format_rank_section("▶︎ Mingguan (7 Hari Terakhir)", week_start, today, f"({format_date(week_start, 'dd/MM/yyyy')} - {today_str})"),
+            lambda: format_rank_section(f"▶︎ Bulanan ({month_name[today.month]})", month_start, today),
+        ])
+        lines = [f"🏆 Laporan Penjualan CS\n📅 Tanggal: {format_date(datetime.now(), 'EEEE, dd MMMM yyyy')}\n"]
+        for section in sections: lines += section
 
-        sent_msg = bot.send_message(chat_id=SALES_GRP_ID, text=msg.strip(), message_thread_id=SALES_THREAD_ID)
-        store[today_key] = sent_msg.message_id
-        _save_message_ids(store)
+        # Hapus semua potongan laporan lama hari ini lalu kirim yang baru
+        chunks = chunk_lines(lines)
+        run_async(publish_report(SALES_GRP_ID, SALES_THREAD_ID, f"sales_report_{today.isoformat()}", chunks))
+        logger.info(f"Laporan penjualan terkirim dalam {len(chunks)} pesan.")
 
     except Exception as e:
         logger.error(f"Gagal mengirim laporan penjualan: {e}", exc_info=True)
-        send_msg(ADMIN_ID, f"Bot Error (Sales Report): {e}")
+        run_async(send_msg(ADMIN_ID, f"Bot Error (Sales Report): {e}"))
 
 def send_closing_reminder():
     now = datetime.now()
@@ -364,127 +1865,560 @@ def send_closing_reminder():
     else: return
         
     topic_remind = [1, 1875, 5838, 19334]
-    for thread_id in topic_remind:
-        send_msg(SALES_GRP_ID, msg, thread_id)
-        logger.info(f"Mengirim reminder ke grup {SALES_GRP_ID}, thread {thread_id}")
+    run_async(gather_async(*[send_msg(SALES_GRP_ID, msg, thread_id) for thread_id in topic_remind]))
+    logger.info(f"Mengirim reminder ke grup {SALES_GRP_ID}, thread {topic_remind}")
+
+def archive_closing():
+    """Memindahkan baris bulan yang sudah ditutup ke arsip SQLite (rollup diperbarui dulu agar tidak ada baris terlewat)."""
+    logger.info("Menjalankan tugas: Arsip Closing.")
+    try:
+        sales_rollup.update()
+        closing_archive.archive()
+    except Exception as e:
+        logger.error(f"Gagal mengarsip Closing: {e}", exc_info=True)
+        run_async(send_msg(ADMIN_ID, f"Bot Error (Arsip Closing): {e}"))
+
+# ==================================================
+# ♠️ Deduplikasi Update Telegram
+# ==================================================
+class ProcessedUpdates:
+    """Penanda update yang sudah diproses: LRU terbatas di memori + tabel SQLite (tahan restart & multi-worker)."""
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, max_keys=DEDUP_MAX_KEYS, ttl_hours=DEDUP_TTL_HOURS):
+        self.max_keys, self.ttl = max_keys, ttl_hours * 3600
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._marks = 0
+        with closing(_db()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS processed_updates (key TEXT PRIMARY KEY, seen REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS written_messages (key TEXT PRIMARY KEY, written REAL NOT NULL)")
+
+    @staticmethod
+    def key(message):
+        """Key unik per (chat_id, message_id, edit_date) agar pesan yang diedit diproses ulang."""
+        edit = int(message.edit_date.timestamp()) if message.edit_date else 0
+        return f"{message.chat.id}:{message.message_id}:{edit}"
+
+    @staticmethod
+    def message_key(message):
+        """Key per pesan (tanpa edit_date), untuk menandai pesan yang pesanannya sudah tertulis."""
+        return f"{message.chat.id}:{message.message_id}"
+
+    def written(self, message_key):
+        with closing(_db()) as conn:
+            return conn.execute("SELECT 1 FROM written_messages WHERE key = ?", (message_key,)).fetchone() is not None
+
+    def mark_written(self, message_key, conn=None):
+        """Menandai pesan sudah menghasilkan baris; False jika sudah ditandai sebelumnya (mis. versi lain dari pesan yang sama)."""
+        if conn is not None:
+            return conn.execute("INSERT OR IGNORE INTO written_messages (key, written) VALUES (?, ?)",
+                                (message_key, time.time())).rowcount == 1
+        with closing(_db()) as conn, conn:
+            return self.mark_written(message_key, conn)
+
+    def _remember(self, key):
+        with self._lock:
+            self._lru[key] = True
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_keys:
+                self._lru.popitem(last=False)
+
+    def seen(self, key):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return True
+        with closing(_db()) as conn:
+            row = conn.execute("SELECT seen FROM processed_updates WHERE key = ?", (key,)).fetchone()
+        if row and row[0] >= time.time() - self.ttl:
+            self._remember(key)
+            return True
+        return False
+
+    def mark(self, key):
+        """Klaim atomik; False jika key sudah ditandai oleh request/worker lain."""
+        now = time.time()
+        with closing(_db()) as conn, conn:
+            claimed = conn.execute("INSERT OR IGNORE INTO processed_updates (key, seen) VALUES (?, ?)", (key, now)).rowcount == 1
+            if not claimed:  # key lama yang sudah kedaluwarsa boleh diklaim ulang
+                claimed = conn.execute("UPDATE processed_updates SET seen = ? WHERE key = ? AND seen < ?",
+                                       (now, key, now - self.ttl)).rowcount == 1
+        self._remember(key)
+        self._marks += 1
+        if self._marks % self.PRUNE_EVERY == 0: self.prune()
+        return claimed
+
+    def prune(self):
+        with closing(_db()) as conn, conn:
+            deleted = conn.execute("DELETE FROM processed_updates WHERE seen < ?", (time.time() - self.ttl,)).rowcount
+            conn.execute("DELETE FROM written_messages WHERE written < ?", (time.time() - self.ttl,))
+        if deleted: logger.info(f"Menghapus {deleted} penanda update kedaluwarsa.")
+
+processed_updates = ProcessedUpdates()
+metrics.gauge("processed_updates_lru_size", "Key update di LRU memori", lambda: len(processed_updates._lru))
+
+class UpdateInbox:
+    """Update Telegram mentah yang disimpan di SQLite sebelum webhook membalas 200.
+
+    Baris dihapus saat pesanan masuk jurnal tulis (satu transaksi) atau saat pemrosesan selesai.
+    Selama diproses, lease diperpanjang berkala (handle_update); baris yang tertinggal (worker
+    mati/restart di tengah jalan) diproses ulang oleh replay_inbox setelah lease habis.
+    """
+
+    LEASE_SECONDS = 300
+
+    def __init__(self):
+        with closing(_db()) as conn, conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS update_inbox (
+                update_id INTEGER PRIMARY KEY, payload TEXT NOT NULL,
+                received REAL NOT NULL, lease_until REAL NOT NULL)""")
+
+    def put(self, update_id, payload):
+        """Menyimpan update; False jika update_id sudah ada (kiriman ulang Telegram)."""
+        now = time.time()
+        with closing(_db()) as conn, conn:
+            return conn.execute("INSERT OR IGNORE INTO update_inbox (update_id, payload, received, lease_until) VALUES (?, ?, ?, ?)",
+                                (update_id, json.dumps(payload), now, now + self.LEASE_SECONDS)).rowcount == 1
+
+    def extend(self, update_id):
+        """Memperpanjang lease update yang masih diproses agar tidak diklaim replay_inbox."""
+        with closing(_db()) as conn, conn:
+            conn.execute("UPDATE update_inbox SET lease_until = ? WHERE update_id = ?", (time.time() + self.LEASE_SECONDS, update_id))
+
+    def done(self, update_id, conn=None):
+        if conn is not None:
+            conn.execute("DELETE FROM update_inbox WHERE update_id = ?", (update_id,))
+            return
+        with closing(_db()) as conn, conn:
+            conn.execute("DELETE FROM update_inbox WHERE update_id = ?", (update_id,))
+
+    def claim_stale(self):
+        """Klaim atomik update yang lease-nya habis; mengembalikan [(update_id, payload)]."""
+        now = time.time()
+        with closing(_db()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT update_id, payload FROM update_inbox WHERE lease_until < ? ORDER BY update_id", (now,)).fetchall()
+            conn.executemany("UPDATE update_inbox SET lease_until = ? WHERE update_id = ?",
+                             [(now + self.LEASE_SECONDS, update_id) for update_id, _ in rows])
+        return [(update_id, json.loads(payload)) for update_id, payload in rows]
+
+    def depth(self):
+        with closing(_db()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM update_inbox").fetchone()[0]
+
+update_inbox = UpdateInbox()
+metrics.gauge("update_inbox_depth", "Update Telegram yang belum selesai diproses", update_inbox.depth)
+
+def replay_inbox():
+    """Memproses ulang update yang tertinggal di inbox (mis. worker mati setelah ACK)."""
+    if not clients.ready: return
+    for update_id, payload in update_inbox.claim_stale():
+        logger.warning(f"Mengulang update {update_id} dari inbox.")
+        submit_async(handle_update(telegram.Update.de_json(payload, clients.bot), retry=True))
+
+def is_msg_processed(update_key):
+    return processed_updates.seen(update_key)
+
+def mark_msg_processed(update_key):
+    return processed_updates.mark(update_key)
 
 # ==================================================
 # ♠️ Webhook Utama & Konfirmasi
 # ==================================================
+EDITED_AFTER_WRITE_MSG = "✏️ Pesanan dari pesan ini sudah tercatat, perubahan lewat edit tidak diproses. Hubungi admin untuk koreksi data."
+
+@app.route('/ready')
+def readiness():
+    """Readiness probe: 200 jika koneksi Telegram & Sheets sudah siap."""
+    status = clients.status()
+    return status, 200 if status['ready'] else 503
+
 @app.route('/webhook', methods=['POST'])
 def webhook_handler():
+    """Menyimpan update ke inbox lalu ACK; pemrosesan berjalan di event loop background."""
+    if not clients.ready:
+        clients.start()
+        return 'not ready', 503 # Telegram akan mengirim ulang update ini
+
     update_data = request.get_json()
-    update = telegram.Update.de_json(update_data, bot)
-    message = update.message or update.edited_message
-    if not message: return 'ok', 200
+    update = telegram.Update.de_json(update_data, clients.bot)
+    if not update_inbox.put(update.update_id, update_data):
+        return 'ok', 200 # Sudah di inbox: sedang diproses atau akan diulang replay_inbox
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        submit_async(_profiled(handle_update(update), f"update-{update.update_id}"))
+    else:
+        submit_async(handle_update(update))
+    return 'ok', 200
+
+async def _keep_leased(update_id):
+    """Heartbeat lease inbox selama update diproses (mis. tertahan rate limit atau /batch yang lambat)."""
+    while True:
+        await asyncio.sleep(UpdateInbox.LEASE_SECONDS / 3)
+        await asyncio.to_thread(update_inbox.extend, update_id)
+
+@timed("handle_update")
+async def handle_update(update, retry=False):
+    """Memproses satu update; retry=True untuk update yang diulang dari inbox."""
+    heartbeat = asyncio.create_task(_keep_leased(update.update_id))
+    try:
+        await _handle_message(update.message or update.edited_message, update.update_id, retry)
+    finally:
+        heartbeat.cancel()
+        await asyncio.to_thread(update_inbox.done, update.update_id)
+
+async def _handle_message(message, update_id, retry):
+    if not message: return
 
     msg_id, chat_id, thread_id = message.message_id, message.chat.id, message.message_thread_id
     user = message.from_user
     cs_name = f"{user.first_name} {user.last_name or ''}".strip()
     text = message.text or message.caption or ""
 
-    if is_msg_processed(msg_id):
+    update_key, message_key = ProcessedUpdates.key(message), ProcessedUpdates.message_key(message)
+    if not retry and await asyncio.to_thread(is_msg_processed, update_key):
         logger.warning(f"Pesan {msg_id} sudah diproses, diabaikan.")
-        return 'ok', 200
+        return
 
-    if not text or not text.lower().startswith("sales"):
+    is_batch = text.lower().startswith(BATCH_COMMAND)
+    if not is_batch and (not text or not text.lower().startswith("sales")):
         if message.photo and "transfer" in text.lower():
-             send_msg(chat_id, "✅ Bukti transfer diterima. Kirim detail pesanan dengan format SALES yang valid.", thread_id)
-        return 'ok', 200
+             await send_msg(chat_id, "✅ Bukti transfer diterima. Kirim detail pesanan dengan format SALES yang valid.", thread_id)
+        return
 
     logger.info(f"Memproses pesanan dari {cs_name} (Chat ID: {chat_id})")
-    mark_msg_processed(msg_id) # Tandai setelah filter awal, sebelum proses berat
+    # Tandai setelah filter awal, sebelum proses berat. Update dari inbox belum pernah masuk jurnal,
+    # jadi penanda dari percobaan sebelumnya diabaikan.
+    if not await asyncio.to_thread(mark_msg_processed, update_key) and not retry:
+        logger.warning(f"Pesan {msg_id} sedang/sudah diproses worker lain, diabaikan.")
+        return
+    if message.edit_date and await asyncio.to_thread(processed_updates.written, message_key):
+        logger.warning(f"Pesan {msg_id} diedit setelah pesanannya tertulis, diabaikan.")
+        await send_msg(chat_id, EDITED_AFTER_WRITE_MSG, thread_id)
+        return
     
     try:
-        platform_match = re.search(r'SALES\s+\d+\s*-\s*(SHOPEE|LAZADA|TIKTOK|TIK TOK)', text, re.IGNORECASE)
-        if platform_match:
-            process_mp_order(chat_id, thread_id, cs_name, text, platform_match.group(1).upper())
+        if is_batch:
+            await handle_batch_command(message, cs_name, text)
+            return
+        with timed("parse_order"):
+            order = parse_order(text)
+        if order.is_mp:
+            # Penanda pesan tertulis kedaluwarsa setelah DEDUP_TTL_HOURS; order ID tetap dicek untuk edit lama
+            if message.edit_date and order.order_id and await asyncio.to_thread(_existing_mp_ids, [order.order_id]):
+                written = False
+            else:
+                written = await process_mp_order(chat_id, thread_id, cs_name, order, update_id, message_key)
         else:
-            process_regular_order(chat_id, thread_id, cs_name, text, message)
-        
-        send_confirmation(chat_id, thread_id, cs_name, parse_order(text), message)
+            written = await process_regular_order(chat_id, thread_id, cs_name, order, message, update_id, retry)
+        if not written:
+            logger.warning(f"Pesan {msg_id} sudah pernah tertulis, edit diabaikan.")
+            await send_msg(chat_id, EDITED_AFTER_WRITE_MSG, thread_id)
+            return
+
+        await send_confirmation(chat_id, thread_id, cs_name, order, message)
     except Exception as e:
         logger.error(f"Error fatal di webhook: {e}", exc_info=True)
-        send_msg(ADMIN_ID, f"Bot Error: {e}")
+        await send_msg(ADMIN_ID, f"Bot Error: {e}")
 
-    return 'ok', 200
+async def process_mp_order(chat_id, thread_id, cs_name, order, update_id=None, message_key=None):
+    """Menjurnal pesanan MP; False jika pesan asalnya sudah pernah tertulis."""
+    day = await asyncio.to_thread(daily_stats.ensure_day)
+    row_data = build_row(order, order.order_id or await asyncio.to_thread(invoice_ids.next, "INV-MP"), cs_name, order.platform)
+    if not await asyncio.to_thread(write_queue.enqueue, SHEET_CLOSING_MP, row_data, update_id, message_key): return False
+    await asyncio.to_thread(daily_stats.add, cs_name, order.qty_box, order.qty_sachet, day)
+    logger.info(f"Pesanan MP {order.nama} masuk antrean tulis.")
+    return True
 
-def process_mp_order(chat_id, thread_id, cs_name, text, platform):
-    result = parse_order(text)
-    row_data = [
-        result.get('order_id') or f"INV-MP-{int(datetime.now().timestamp())}",
-        format_date(datetime.now(), "dd/MM/yyyy"), cs_name, result.get('nama'), result.get('no hp'),
-        result.get('alamat'), result.get('kelurahan'), result.get('kecamatan'), result.get('kota/kab'),
-        result.get('kode pos'), "DOORASI", result.get('sku'), result.get('qty_box'), result.get('qty_sachet'),
-        result.get('total pembayaran'), result.get('ongkir'), result.get('ekspedisi'),
-        platform, result.get('notes'), datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-    ]
-    closing_mp_sheet.append_row(row_data, value_input_option='USER_ENTERED')
-    logger.info(f"Pesanan MP {result.get('nama')} berhasil disimpan.")
-
-def process_regular_order(chat_id, thread_id, cs_name, text, message):
-    error = validate_order(text)
+async def process_regular_order(chat_id, thread_id, cs_name, order, message, update_id=None, retry=False):
+    """Validasi, cek duplikat, lalu menjurnal pesanan reguler; False jika pesan asalnya sudah pernah tertulis."""
+    error = validate_order(order)
     if error:
-        send_msg(chat_id, error, thread_id)
+        await send_msg(chat_id, error, thread_id)
         raise ValueError(f"Pesanan dari {cs_name} gagal validasi: {error}")
 
-    result = parse_order(text)
-    notes, phone, addr = result.get('notes', ""), result.get('no hp'), result.get('alamat')
-    
-    if "#ro" not in text.lower():
-        if dup_check := is_dup_phone(phone, addr, closing_sheet):
-            send_msg(chat_id, f"🚨 {dup_check} Silakan periksa kembali.", thread_id)
-            raise ValueError(f"Pesanan duplikat terdeteksi: {dup_check}")
-    
-    if "agen" in notes.lower() and not is_valid_agent_code(notes):
-        send_msg(chat_id, "🚨 Kode Agen tidak valid/terdaftar.", thread_id)
+    notes, phone, addr = order.notes, order.no_hp, order.alamat
+    owner = str(update_id) if update_id is not None else None
+
+    if "agen" in notes.lower() and not await asyncio.to_thread(is_valid_agent_code, notes):
+        await send_msg(chat_id, "🚨 Kode Agen tidak valid/terdaftar.", thread_id)
         raise ValueError(f"Kode agen tidak valid: {notes}")
+
+    if "#ro" not in order.text.lower():
+        if dup_check := await asyncio.to_thread(is_dup_phone, phone, addr, closing_dup_index, order.kecamatan, order.kota_kab, owner, retry):
+            await send_msg(chat_id, f"🚨 {dup_check} Silakan periksa kembali.", thread_id)
+            raise ValueError(f"Pesanan duplikat terdeteksi: {dup_check}")
+    else:
+        await asyncio.to_thread(closing_dup_index.add, phone, addr, kecamatan=order.kecamatan, kota_kab=order.kota_kab, owner=owner)
     
-    row_data = [
-        f"INV-{int(datetime.now().timestamp())}",
-        format_date(datetime.now(), "dd/MM/yyyy"), cs_name, result.get('nama'), phone, addr,
-        result.get('kelurahan'), result.get('kecamatan'), result.get('kota/kab'), result.get('kode pos'), 
-        "DOORASI", result.get('sku'), result.get('qty_box'), result.get('qty_sachet'),
-        result.get('total pembayaran'), result.get('ongkir'), result.get('ekspedisi'),
-        result.get('pembayaran'), notes, datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-    ]
-    closing_sheet.append_row(row_data, value_input_option='USER_ENTERED')
-    logger.info(f"Pesanan reguler {result.get('nama')} berhasil disimpan.")
+    day = await asyncio.to_thread(daily_stats.ensure_day)
+    row_data = build_row(order, await asyncio.to_thread(invoice_ids.next), cs_name, order.pembayaran)
+    if not await asyncio.to_thread(write_queue.enqueue, SHEET_CLOSING, row_data, update_id, ProcessedUpdates.message_key(message)):
+        return False
+    await asyncio.to_thread(daily_stats.add, cs_name, order.qty_box, order.qty_sachet, day)
+    logger.info(f"Pesanan reguler {order.nama} masuk antrean tulis.")
+    return True
 
-def send_confirmation(chat_id, thread_id, cs_name, result, message):
-    stats = get_combined_stats(cs_name)
+@timed("send_confirmation")
+async def send_confirmation(chat_id, thread_id, cs_name, order, message):
+    stats = await asyncio.to_thread(get_combined_stats, cs_name)
     msg_header = f"{cs_name} ★ {stats['invoices']} INVOICE - {stats['box']} Box - {stats['sachet']} Sachet"
-    pay_method = result.get('pembayaran', "").upper()
-    notes = result.get('notes', "").lower()
+    pay_method = order.pembayaran.upper()
+    notes = order.notes.lower()
+    sends = []
     
     if "agen" in notes:
-        user_msg = f"{msg_header}\n\n🥷🏻 Data ter-supply untuk {result.get('notes')}"
-        send_msg(chat_id, user_msg, thread_id)
+        user_msg = f"{msg_header}\n\n🥷🏻 Data ter-supply untuk {order.notes}"
+        sends.append(send_msg(chat_id, user_msg, thread_id, coalesce=True))
         if pay_method == "TRANSFER" and message.photo:
-            fwd_msg(AGENT_GROUP_ID, chat_id, message.message_id)
+            sends.append(fwd_msg(AGENT_GROUP_ID, chat_id, message.message_id))
     else:
         if pay_method == "TRANSFER":
-            user_msg = f"{msg_header}\n\n🏧 Orderan Transfer {result.get('nama')} diterima"
-            send_msg(chat_id, user_msg, thread_id)
+            user_msg = f"{msg_header}\n\n🏧 Orderan Transfer {order.nama} diterima"
+            sends.append(send_msg(chat_id, user_msg, thread_id, coalesce=True))
             if message.photo:
-                fwd_msg(OLD_TRANSFER_GROUP_ID, chat_id, message.message_id)
+                sends.append(fwd_msg(OLD_TRANSFER_GROUP_ID, chat_id, message.message_id))
         else:
-            user_msg = f"{msg_header}\n\n✅ Success! {result.get('nama')} berhasil diinput"
-            send_msg(chat_id, user_msg, thread_id)
+            user_msg = f"{msg_header}\n\n✅ Success! {order.nama} berhasil diinput"
+            sends.append(send_msg(chat_id, user_msg, thread_id, coalesce=True))
+    await asyncio.gather(*sends)
 
 # ==================================================
-# ♠️ Titik Mulai Aplikasi & Scheduler
+# ♠️ Input Batch (backfill)
 # ==================================================
-if __name__ == "__main__":
-    # Inisialisasi Scheduler
+BATCH_COMMAND = "/batch"
+SALES_SPLIT_RE = re.compile(r'(?im)^(?=[ \t]*sales\b)')
+
+def split_sales_block(text):
+    """Memecah teks tempelan berisi beberapa pesan SALES menjadi list pesan."""
+    return [part.strip() for part in SALES_SPLIT_RE.split(text) if part.strip().lower().startswith("sales")]
+
+def _record_to_sales(record, no):
+    """Menyusun teks SALES dari satu baris CSV berheader seperti sheet Closing."""
+    get = lambda *keys: next((record[k] for k in keys if record.get(k)), "")
+    box, sachet = get("QTY BOX"), get("QTY SACHET")
+    qty = " ".join(p for p in (f"{box} Box" if box not in ("", "0") else "", f"{sachet} Sachet" if sachet not in ("", "0") else "") if p)
+    header = f"SALES {no} - {get('PLATFORM')}\n{get('ORDER ID', 'INVOICE')}" if get("PLATFORM") else f"SALES {no}"
+    lines = [
+        header, f"Doorasi: {qty}", f"SKU: {get('SKU')}", f"Ongkir: {get('ONGKIR')}",
+        f"Total Pembayaran: {get('TOTAL PEMBAYARAN', 'TOTAL')}", f"Ekspedisi: {get('EKSPEDISI')} - {get('PEMBAYARAN')}",
+        f"Nama: {get('NAMA')}", f"No HP: {get('WHATSAPP', 'NO HP')}", f"Alamat Jalan: {get('ALAMAT')}",
+        f"Desa/Kelurahan: {get('KELURAHAN')}", f"Kecamatan: {get('KECAMATAN')}", f"Kab/Kota: {get('KOTA/KAB')}",
+        f"Kode Pos: {get('KODE POS')}", get("NOTES"),
+    ]
+    return "\n".join(line for line in lines if line)
+
+def parse_batch_csv(content, default_cs=""):
+    """Baris CSV -> list (teks SALES, nama CS). Kolom TEXT/PESAN berisi pesan mentah; selain itu kolom mengikuti header Closing."""
+    entries = []
+    for record in csv.DictReader(io.StringIO(content)):
+        record = {str(k).strip().upper(): str(v or "").strip() for k, v in record.items() if k}
+        text = record.get("TEXT") or record.get("PESAN") or _record_to_sales(record, len(entries) + 1)
+        entries.append((text, record.get("CUSTOMER SERVICE") or default_cs))
+    return entries
+
+def _existing_mp_ids(order_ids):
+    """Order ID marketplace yang sudah tercatat di Closing MP: sheet (kolom invoice), arsip, dan antrean tulis."""
+    if not order_ids: return set()
+    existing = {invoice for (invoice,) in iter_rows(clients.sheet(SHEET_CLOSING_MP), (0,), chunk_rows=CHUNK_ROWS * 10)}
+    existing.update(invoice for (invoice,) in closing_archive.records(SHEET_CLOSING_MP, (0,)))
+    existing.update(invoice for (invoice,) in write_queue.pending_rows(SHEET_CLOSING_MP, ("INVOICE",)))
+    return existing & set(order_ids)
+
+def ingest_batch(entries, dry_run=False):
+    """Memproses banyak pesanan sekaligus: validasi, dedup antar pesanan & terhadap indeks sheet, satu append_rows per worksheet.
+
+    entries: list (teks SALES, nama CS). Mengembalikan ringkasan untuk format_batch_summary.
+    """
+    closing_dup_index.sync()
+    rows = {SHEET_CLOSING: [], SHEET_CLOSING_MP: []}
+    accepted, rejected = [], []
+    batch_phones, batch_addrs, batch_mp_ids = set(), set(), set()
+    orders = [(parse_order(text), cs_name) for text, cs_name in entries]
+    existing_mp_ids = _existing_mp_ids([order.order_id for order, _ in orders if order.is_mp and order.order_id])
+
+    for no, (order, cs_name) in enumerate(orders, start=1):
+        label = f"#{no} {order.nama or '-'}"
+        if not cs_name:
+            rejected.append((label, "Nama CS kosong"))
+            continue
+        if order.is_mp:
+            if order.order_id in existing_mp_ids:
+                rejected.append((label, f"Order ID {order.order_id} sudah ada di {SHEET_CLOSING_MP}"))
+                continue
+            if order.order_id and order.order_id in batch_mp_ids:
+                rejected.append((label, f"Order ID {order.order_id} ganda di batch"))
+                continue
+            if order.order_id: batch_mp_ids.add(order.order_id)
+            rows[SHEET_CLOSING_MP].append(build_row(order, order.order_id or invoice_ids.next("INV-MP"), cs_name, order.platform))
+        else:
+            addr_key = closing_dup_index._addr_key(order.alamat, order.kecamatan, order.kota_kab)
+            error = validate_order(order)
+            if not error and "agen" in order.notes.lower() and not is_valid_agent_code(order.notes):
+                error = "Kode Agen tidak valid/terdaftar"
+            if not error and "#ro" not in order.text.lower():
+                if (order.no_hp and order.no_hp in batch_phones) or (addr_key and addr_key in batch_addrs):
+                    error = "Duplikat dengan pesanan lain di batch"
+                elif dup := closing_dup_index.check(order.no_hp, order.alamat, reserve=not dry_run,
+                                                    kecamatan=order.kecamatan, kota_kab=order.kota_kab):
+                    error = dup
+            if error:
+                rejected.append((label, error.replace("🚨 ", "").replace("\n", "; ")))
+                continue
+            if order.no_hp: batch_phones.add(order.no_hp)
+            if addr_key: batch_addrs.add(addr_key)
+            if "#ro" in order.text.lower() and not dry_run:
+                closing_dup_index.add(order.no_hp, order.alamat, kecamatan=order.kecamatan, kota_kab=order.kota_kab)
+            rows[SHEET_CLOSING].append(build_row(order, invoice_ids.next(), cs_name, order.pembayaran))
+        accepted.append((cs_name, order))
+
+    queued = []
+    if not dry_run:
+        day = daily_stats.ensure_day()
+        queued = [name for name, values in rows.items() if values and not write_queue.write_now(name, values)]
+        for cs_name, order in accepted:
+            daily_stats.add(cs_name, order.qty_box, order.qty_sachet, day)
+    return {'total': len(entries), 'accepted': accepted, 'rejected': rejected, 'dry_run': dry_run,
+            'rows': {name: len(values) for name, values in rows.items()}, 'queued': queued}
+
+def format_batch_summary(result, max_len=TG_MAX_MESSAGE_LEN):
+    """Satu pesan ringkasan hasil batch (dipotong agar muat satu pesan Telegram)."""
+    rows = result['rows']
+    lines = [
+        f"📦 Batch{' (uji coba, tidak ditulis)' if result['dry_run'] else ''}: {result['total']} pesanan",
+        f"✅ Diterima: {len(result['accepted'])} (Closing {rows[SHEET_CLOSING]}, Closing MP {rows[SHEET_CLOSING_MP]})",
+        f"🚫 Ditolak: {len(result['rejected'])}",
+    ]
+    per_cs = defaultdict(lambda: [0, 0, 0])
+    for cs_name, order in result['accepted']:
+        stats = per_cs[cs_name]
+        stats[0] += 1; stats[1] += order.qty_box; stats[2] += order.qty_sachet
+    lines += [f"• {cs}: {i} Invoice | {b} Box | {s} Sachet" for cs, (i, b, s) in sorted(per_cs.items())]
+    for name in result['queued']:
+        lines.append(f"⏳ {name} gagal ditulis langsung, masuk antrean tulis.")
+    if result['rejected']: lines.append("")
+    footer_room = 40
+    for i, (label, reason) in enumerate(result['rejected']):
+        line = f"{label}: {reason}"
+        if sum(len(l) + 1 for l in lines) + len(line) + footer_room > max_len:
+            lines.append(f"... dan {len(result['rejected']) - i} lainnya")
+            break
+        lines.append(line)
+    return "\n".join(lines)
+
+async def handle_batch_command(message, cs_name, text):
+    """/batch [nama CS] diikuti beberapa pesan SALES, atau dengan lampiran CSV. Khusus admin."""
+    chat_id, thread_id = message.chat.id, message.message_thread_id
+    if str(message.from_user.id) not in BATCH_ADMIN_IDS:
+        await send_msg(chat_id, "🚫 Perintah /batch hanya untuk admin.", thread_id)
+        return
+    first_line, _, body = text.partition("\n")
+    args = first_line.split(maxsplit=1)
+    default_cs = args[1].strip() if len(args) > 1 else cs_name
+    if message.document:
+        tg_file = await clients.bot.get_file(message.document.file_id)
+        content = bytes(await tg_file.download_as_bytearray()).decode('utf-8-sig')
+        entries = parse_batch_csv(content, default_cs)
+    else:
+        entries = [(entry, default_cs) for entry in split_sales_block(body)]
+    if not entries:
+        await send_msg(chat_id, "🚨 Tidak ada pesanan SALES/CSV yang bisa dibaca dari perintah /batch.", thread_id)
+        return
+    result = await asyncio.to_thread(ingest_batch, entries)
+    if result['accepted']: await asyncio.to_thread(processed_updates.mark_written, ProcessedUpdates.message_key(message))
+    await send_msg(chat_id, format_batch_summary(result), thread_id)
+
+@app.cli.command("ingest")
+@click.argument("source", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--cs", "cs_name", default="", help="Nama CS untuk pesanan tanpa kolom CUSTOMER SERVICE.")
+@click.option("--csv", "as_csv", is_flag=True, help="Paksa baca sebagai CSV (otomatis untuk file .csv).")
+@click.option("--dry-run", is_flag=True, help="Hanya validasi & cek duplikat, tidak menulis ke sheet.")
+def ingest_command(source, cs_name, as_csv, dry_run):
+    """Input batch pesanan dari file CSV atau teks berisi beberapa pesan SALES ('-' untuk stdin)."""
+    content = source.read()
+    if as_csv or source.name.lower().endswith(".csv"):
+        entries = parse_batch_csv(content, cs_name)
+    else:
+        entries = [(entry, cs_name) for entry in split_sales_block(content)]
+    if not entries: raise click.ClickException("Tidak ada pesanan yang bisa dibaca.")
+    clients.wait(60)
+    click.echo(format_batch_summary(ingest_batch(entries, dry_run=dry_run), max_len=10**9))
+
+@app.cli.command("requeue-dead-letters")
+def requeue_dead_letters_command():
+    """Mengembalikan baris di write_dead_letter ke antrean tulis setelah penyebabnya diperbaiki."""
+    click.echo(f"{write_queue.requeue_dead_letters()} baris dikembalikan ke antrean tulis.")
+
+# ==================================================
+# ♠️ Titik Mulai Aplikasi & Scheduler (satu leader untuk semua worker)
+# ==================================================
+def build_scheduler():
+    """Job terjadwal global; hanya dijalankan oleh proses leader."""
     scheduler = BackgroundScheduler(daemon=True, timezone='Asia/Jakarta')
     scheduler.add_job(send_closing_reminder, 'cron', hour='11,14,18', minute='0')
     scheduler.add_job(send_sales_report, 'cron', hour='21', minute='0') # Laporan penjualan jam 9 malam
     scheduler.add_job(send_available_agents, 'cron', hour='8', minute='0') # Notif agen jam 8 pagi
-    scheduler.start()
-    
+    if ARCHIVE_ENABLED:
+        scheduler.add_job(archive_closing, 'cron', hour='2', minute='30') # Arsip bulan yang sudah ditutup
+    return scheduler
+
+class SchedulerLeader:
+    """Pemilihan leader lewat flock: proses pemegang lock menjalankan scheduler, proses lain menunggu giliran.
+
+    Lock otomatis lepas saat proses leader mati, sehingga worker lain mengambil alih.
+    """
+
+    RETRY_SECONDS = 30
+
+    def __init__(self, lock_path, build):
+        self.lock_path, self.build = lock_path, build
+        self.is_leader = False
+        self.scheduler = None
+        self._lock_file = None
+
+    def _try_acquire(self):
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0); lock_file.truncate()
+        lock_file.write(str(os.getpid())); lock_file.flush()
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._try_acquire():
+            time.sleep(self.RETRY_SECONDS)
+        self.scheduler = self.build()
+        self.scheduler.start()
+        self.is_leader = True
+        logger.info(f"Proses {os.getpid()} menjadi leader scheduler.")
+
+    def start(self):
+        threading.Thread(target=self._run, name="scheduler-leader", daemon=True).start()
+
+scheduler_leader = SchedulerLeader(SCHEDULER_LOCK_PATH, build_scheduler)
+metrics.gauge("scheduler_leader", "1 jika proses ini menjalankan job terjadwal", lambda: int(scheduler_leader.is_leader))
+
+# Sinkron indeks duplikat (cache per proses) & replay inbox jalan di setiap worker
+local_scheduler = BackgroundScheduler(daemon=True, timezone='Asia/Jakarta')
+local_scheduler.add_job(closing_dup_index.sync, 'interval', minutes=DUP_RESYNC_MINUTES)
+local_scheduler.add_job(replay_inbox, 'interval', minutes=1) # Update yang tertinggal setelah worker mati
+
+def start_schedulers():
+    """Menyalakan scheduler; hanya dipanggil dari entry point server (__main__ / gunicorn.conf.py),
+    bukan saat import, agar CLI & skrip yang mengimpor app tidak ikut menjadi leader."""
+    if not SCHEDULER_ENABLED or local_scheduler.running: return
+    scheduler_leader.start()
+    local_scheduler.start()
     logger.info("Scheduler berhasil dimulai.")
-    
+
+if __name__ == "__main__":
+    start_schedulers()
+
     # Menjalankan server web Flask
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Benchmark pencarian alamat mirip (AddressIndex) dalam satu blok kecamatan/kota.
+
+Skenario terburuk: semua entri berada di kecamatan & kota yang sama dan di
+beberapa jalan saja, hanya nomor rumah & RT/RW yang berbeda.
+
+Pemakaian:
+    python bench_address.py [--entries 30000] [--queries 2000] [--streets 5]
+"""
+
+import argparse
+import random
+import time
+from datetime import date
+
+from address_match import AddressIndex
+
+STREETS = ["Mawar", "Melati", "Kenanga", "Raya Bogor", "Griya Asri"]
+PREFIXES = ["Jl.", "Jalan", "Jln", "jl"]
+
+
+def make_address(rng, street, number, rt, rw):
+    """Satu alamat dengan penulisan acak (singkatan, nol di depan, urutan & format RT/RW)."""
+    rt_rw = rng.choice([f"RT {rt:02d}/RW {rw:02d}", f"rt {rt} rw {rw}", f"RW {rw} RT {rt}", f"RT.{rt:03d} RW.{rw}"])
+    return f"{rng.choice(PREFIXES)} {street} {rng.choice(['No.', 'no', 'Nomor'])} {number} {rt_rw}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=30000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--streets", type=int, default=len(STREETS))
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    streets = STREETS[:args.streets]
+    today = date.today()
+    keys = [(rng.choice(streets), rng.randint(1, 300), rng.randint(1, 20), rng.randint(1, 15)) for _ in range(args.entries)]
+
+    index = AddressIndex()
+    start = time.perf_counter()
+    for i, key in enumerate(keys):
+        index.add(make_address(rng, *key), "Kec. Cibinong", "Kab. Bogor", f"62811{i:07d}", today)
+    build = time.perf_counter() - start
+
+    # Separuh query menulis ulang alamat yang sudah ada (harus ketemu), separuh nomor rumah baru (tidak boleh ketemu)
+    existing = [(make_address(rng, *rng.choice(keys)), True) for _ in range(args.queries // 2)]
+    fresh = [(make_address(rng, rng.choice(streets), rng.randint(301, 999), 1, 1), False) for _ in range(args.queries - len(existing))]
+    queries = existing + fresh
+    rng.shuffle(queries)
+
+    found = missed = false_hits = 0
+    start = time.perf_counter()
+    for address, expected in queries:
+        hit = index.find(address, "Cibinong", "Bogor") is not None
+        if expected: found += hit; missed += not hit
+        else: false_hits += hit
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(index)} entri unik (dari {args.entries}) di {args.streets} jalan, dibangun dalam {build:.2f}s")
+    print(f"{len(queries)} pencarian dalam {elapsed * 1000:.1f} ms -> {elapsed / len(queries) * 1e6:.1f} µs/pencarian")
+    print(f"Alamat lama ditemukan {found}/{len(existing)}, terlewat {missed}; alamat baru salah cocok {false_hits}/{len(fresh)}")
+
+
+if __name__ == "__main__":
+    main()
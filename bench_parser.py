@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Benchmark throughput parser pesan SALES.
+
+Pemakaian:
+    python bench_parser.py [--messages 2000] [--repeat 5]
+"""
+
+import os
+import argparse
+import random
+import tempfile
+import time
+
+NAMES = ["Budi Santoso", "Siti Aminah", "Dewi Lestari", "Agus Salim", "Rina Wati", "Joko Susilo"]
+STREETS = ["Jl. Mawar No. 12", "Jalan Melati Gg. 3 No 7", "Jl Kenanga RT 02/RW 05", "Perum Griya Asri Blok C4"]
+KECAMATAN = ["Cibinong", "Cileungsi", "Bojonggede", "Sukmajaya", "Tapos"]
+KOTA = ["Kab. Bogor", "Kota Depok", "Kota Bekasi", "Kab. Tangerang"]
+EKSPEDISI = ["JNE", "jnt", "ID", "ninja", "SAP", "spx"]
+
+
+def make_message(rng, i):
+    """Membuat satu pesan SALES sintetis (reguler atau marketplace)."""
+    box, sachet = rng.choice([(1, 0), (2, 0), (3, 0), (0, 5), (0, 10)])
+    qty = f"{box} Box" if box else f"{sachet} Sachet"
+    sku = f"DRSBOX-{box}" if box else f"DRSA-{sachet}"
+    platform = rng.random() < 0.2
+    header = f"SALES {i} - {rng.choice(['SHOPEE', 'TIKTOK', 'LAZADA'])}\n{rng.randint(10**9, 10**10)}" if platform else f"SALES {i}"
+    lines = [
+        header,
+        f"Doorasi: {qty} Rp {rng.randint(150, 900)}k",
+        f"SKU: {sku}",
+        f"Ongkir: Rp {rng.randint(10, 40)}.000",
+        f"Total Pembayaran: Rp {rng.randint(160, 950)}.000",
+        f"Ekspedisi: {rng.choice(EKSPEDISI)} - {rng.choice(['COD', 'TRANSFER'])}",
+        f"Nama: {rng.choice(NAMES)}",
+        f"No HP: 08{rng.randint(10**9, 10**10 - 1)}",
+        f"Alamat Jalan: {rng.choice(STREETS)}",
+        f"Desa/Kelurahan: Desa {rng.randint(1, 40)}",
+        f"Kecamatan: {rng.choice(KECAMATAN)}",
+        f"Kab/Kota: {rng.choice(KOTA)}",
+        f"Kode Pos: {rng.randint(10000, 99999)}",
+    ]
+    if rng.random() < 0.3:
+        lines.append(f"Agen {rng.choice(NAMES)} #{rng.randint(1, 99)}")
+    if rng.random() < 0.1:
+        lines.append("#ro")
+    return "\n".join(lines)
+
+
+def make_corpus(n, seed=42):
+    rng = random.Random(seed)
+    return [make_message(rng, i + 1) for i in range(n)]
+
+
+def main():
+    # Backend palsu & state sementara: mengimpor app tidak boleh menyentuh Sheets/Telegram asli,
+    # membuat bot_state.db di direktori kerja, atau ikut memperebutkan leader scheduler
+    os.environ.update({
+        'BOT_BACKEND': 'fake', 'SCHEDULER_ENABLED': '0',
+        'STATE_DB_PATH': os.path.join(tempfile.mkdtemp(prefix="bench-parser-"), "state.db"),
+    })
+    from app import ORDER_PARSER, validate_order
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            order = ORDER_PARSER.parse(text)
+            if not order.is_mp: validate_order(order)
+        best = min(best, time.perf_counter() - start)
+
+    print(f"{len(corpus)} pesan dalam {best * 1000:.1f} ms (terbaik dari {args.repeat}) "
+          f"-> {len(corpus) / best:,.0f} pesan/detik, {best / len(corpus) * 1e6:.1f} µs/pesan")
+
+
+if __name__ == "__main__":
+    main()
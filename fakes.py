@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Backend palsu (in-memory) pengganti Google Sheets & Telegram untuk uji beban lokal.
+
+Aktif jika BOT_BACKEND=fake. Latensi dan error kuota bisa disuntikkan lewat env:
+FAKE_SHEETS_LATENCY, FAKE_SHEETS_ERROR_RATE, FAKE_TG_LATENCY, FAKE_TG_ERROR_RATE.
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import Counter
+from datetime import datetime
+
+import telegram
+from telegram.error import RetryAfter
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range
+
+CLOSING_HEADER = [
+    "INVOICE", "TANGGAL", "CUSTOMER SERVICE", "NAMA", "WHATSAPP", "ALAMAT", "KELURAHAN", "KECAMATAN",
+    "KOTA/KAB", "KODE POS", "PRODUK", "SKU", "QTY BOX", "QTY SACHET", "TOTAL PEMBAYARAN", "ONGKIR",
+    "EKSPEDISI", "PEMBAYARAN", "NOTES", "TANGGAL INPUT",
+]
+
+
+class _QuotaResponse:
+    """Respons minimal agar bisa membuat gspread APIError 429."""
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {"error": {"code": 429, "message": self.text, "status": "RESOURCE_EXHAUSTED"}}
+
+
+class FakeWorksheet:
+    """Worksheet in-memory dengan subset API gspread yang dipakai app.py."""
+
+    def __init__(self, title, header, rows=None, latency=0.0, error_rate=0.0):
+        self.title = title
+        self.rows = [list(header)] + [list(r) for r in rows or []]
+        self.latency, self.error_rate = latency, error_rate
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self.error_rate and random.random() < self.error_rate:
+            raise APIError(_QuotaResponse())
+
+    def _slice(self, range_name):
+        grid = a1_range_to_grid_range(range_name)
+        r0, r1 = grid.get("startRowIndex", 0), grid.get("endRowIndex")
+        c0, c1 = grid.get("startColumnIndex", 0), grid.get("endColumnIndex")
+        with self._lock:
+            return [[str(v) for v in row[c0:c1]] for row in self.rows[r0:r1]]
+
+    @staticmethod
+    def _trim(values):
+        """Seperti API asli: sel kosong di akhir baris & baris kosong di akhir range tidak dikembalikan."""
+        values = [row[:max((i + 1 for i, v in enumerate(row) if v != ""), default=0)] for row in values]
+        while values and not values[-1]: values.pop()
+        return values
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    def row_values(self, row, **kwargs):
+        self._call("row_values")
+        with self._lock:
+            return [str(v) for v in self.rows[row - 1]] if row <= len(self.rows) else []
+
+    def col_values(self, col, **kwargs):
+        self._call("col_values")
+        with self._lock:
+            return [str(r[col - 1]) if len(r) >= col else "" for r in self.rows]
+
+    def get_values(self, range_name=None, **kwargs):
+        self._call("get_values")
+        return self._slice(range_name) if range_name else self._slice("A1:ZZ")
+
+    def batch_get(self, ranges, **kwargs):
+        self._call("batch_get")
+        return [self._trim(self._slice(r)) for r in ranges]
+
+    def get_all_records(self, **kwargs):
+        self._call("get_all_records")
+        with self._lock:
+            header, rows = self.rows[0], self.rows[1:]
+            return [dict(zip(header, r)) for r in rows]
+
+    def delete_rows(self, start_index, end_index=None):
+        self._call("delete_rows")
+        with self._lock:
+            del self.rows[start_index - 1:(end_index or start_index)]
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows")
+        with self._lock:
+            self.rows.extend(list(v) for v in values)
+
+
+class FakeSpreadsheet:
+    """Spreadsheet berisi worksheet Closing, Closing MP & AGEN."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, agent_codes=()):
+        self.title = "Fake Doorasi"
+        agents = [[i + 1, code] for i, code in enumerate(agent_codes)]
+        self._sheets = {
+            "Closing": FakeWorksheet("Closing", CLOSING_HEADER, latency=latency, error_rate=error_rate),
+            "Closing MP": FakeWorksheet("Closing MP", CLOSING_HEADER, latency=latency, error_rate=error_rate),
+            "AGEN": FakeWorksheet("AGEN", ["NO", "KODE AGEN"], agents, latency=latency, error_rate=error_rate),
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(latency=float(os.getenv('FAKE_SHEETS_LATENCY', 0)),
+                   error_rate=float(os.getenv('FAKE_SHEETS_ERROR_RATE', 0)),
+                   agent_codes=[f"Agen Uji #{i}" for i in range(1, 51)])
+
+    def worksheet(self, title):
+        if title not in self._sheets: raise WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def worksheets(self):
+        return list(self._sheets.values())
+
+    def calls(self):
+        """Total panggilan API per worksheet & method."""
+        total = Counter()
+        for ws in self._sheets.values():
+            total.update({f"{ws.title}.{m}": n for m, n in ws.calls.items()})
+        return total
+
+
+class FakeBot(telegram.Bot):
+    """Bot Telegram palsu: tidak ada jaringan, semua pesan dicatat di self.sent."""
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        super().__init__(token="0:fake")
+        with self._unfrozen():
+            self.latency, self.error_rate = latency, error_rate
+            self.sent = []  # (waktu monotonic, method, kwargs)
+            self._next_id = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(latency=float(os.getenv('FAKE_TG_LATENCY', 0)),
+                   error_rate=float(os.getenv('FAKE_TG_ERROR_RATE', 0)))
+
+    async def _fake_call(self, method, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self.error_rate and random.random() < self.error_rate:
+            raise RetryAfter(1)
+        with self._unfrozen():
+            self._next_id += 1
+        self.sent.append((time.monotonic(), method, kwargs))
+        return self._next_id
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def send_message(self, chat_id, text, message_thread_id=None, **kwargs):
+        msg_id = await self._fake_call("send_message", chat_id=chat_id, text=text, message_thread_id=message_thread_id)
+        return telegram.Message(message_id=msg_id, date=datetime.now(), text=text,
+                                chat=telegram.Chat(id=int(chat_id or 0), type="supergroup"))
+
+    async def forward_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._fake_call("forward_message", chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id)
+        return True
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._fake_call("delete_message", chat_id=chat_id, message_id=message_id)
+        return True
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._fake_call("delete_messages", chat_id=chat_id, message_ids=list(message_ids))
+        return True
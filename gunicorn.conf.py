@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""Konfigurasi gunicorn: scheduler dinyalakan per worker setelah app dimuat.
+
+Pemakaian:
+    gunicorn app:app   # file ini dibaca otomatis dari direktori kerja
+"""
+
+
+def post_worker_init(worker):
+    # Hanya satu worker yang benar-benar menjadi leader (file lock), sisanya menunggu giliran
+    import app
+    app.start_schedulers()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Uji beban end-to-end untuk /webhook dengan backend palsu (fakes.py).
+
+Mengirim ribuan update SALES sintetis ke /webhook lalu melaporkan latensi ACK,
+latensi end-to-end (sampai konfirmasi terkirim), throughput, dan jumlah
+panggilan Sheets per pesanan.
+
+Pemakaian:
+    python loadtest.py --orders 2000 --concurrency 32 --sheets-latency 0.3 --tg-latency 0.05
+    python loadtest.py --url http://localhost:5000/webhook   # hanya latensi ACK server lain
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_parser import make_corpus
+
+CHAT_ID = -1001234567890
+
+
+def percentile(values, pct):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def make_updates(n):
+    """Update Telegram sintetis; tiap pesanan punya thread, no HP & alamat unik agar lolos cek duplikat."""
+    updates = []
+    for i, text in enumerate(make_corpus(n), start=1):
+        text = re.sub(r"No HP: .*", f"No HP: 0857{i:08d}", text)
+        text = re.sub(r"Alamat Jalan: .*", f"Alamat Jalan: Jl. Uji Beban No. {i}", text)
+        text = re.sub(r"Agen .* #\d+", f"Agen Uji #{i % 50 + 1}", text)
+        updates.append({
+            "update_id": i,
+            "message": {
+                "message_id": i, "date": int(time.time()), "message_thread_id": i, "text": text,
+                "chat": {"id": CHAT_ID, "type": "supergroup", "is_forum": True},
+                "from": {"id": 1000 + i % 8, "is_bot": False, "first_name": f"CS{i % 8}"},
+            },
+        })
+    return updates
+
+
+def post_all(post, updates, concurrency):
+    """Mengirim semua update secara paralel; mengembalikan {thread_id: (t_kirim, latensi_ack)}."""
+    results = {}
+    lock = threading.Lock()
+
+    def send(update):
+        start = time.monotonic()
+        status = post(update)
+        with lock:
+            results[update["message"]["message_thread_id"]] = (start, time.monotonic() - start, status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, updates))
+    return results
+
+
+def report(title, values):
+    print(f"{title:<22} p50 {percentile(values, 50) * 1000:8.1f} ms | p99 {percentile(values, 99) * 1000:8.1f} ms | "
+          f"max {max(values, default=0) * 1000:8.1f} ms")
+
+
+def run_remote(args, updates):
+    import httpx
+    client = httpx.Client(timeout=30)
+    started = time.monotonic()
+    results = post_all(lambda u: client.post(args.url, json=u).status_code, updates, args.concurrency)
+    elapsed = time.monotonic() - started
+    errors = sum(1 for *_, status in results.values() if status != 200)
+    print(f"{len(updates)} update dalam {elapsed:.2f}s ({len(updates) / elapsed:.1f} req/s), {errors} non-200")
+    report("Latensi ACK", [ack for _, ack, _ in results.values()])
+
+
+def run_local(args, updates):
+    os.environ.update({
+        'BOT_BACKEND': 'fake',
+        'STATE_DB_PATH': os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "state.db"),
+        'FAKE_SHEETS_LATENCY': str(args.sheets_latency), 'FAKE_SHEETS_ERROR_RATE': str(args.sheets_error_rate),
+        'FAKE_TG_LATENCY': str(args.tg_latency), 'FAKE_TG_ERROR_RATE': str(args.tg_error_rate),
+        'WRITE_FLUSH_SECONDS': '0.5',
+        'TG_GLOBAL_RATE': str(args.tg_global_rate), 'TG_GROUP_RATE_PER_MIN': str(args.tg_group_rate), 'TG_CHAT_BURST': str(args.tg_chat_burst),
+    })
+    import app
+
+    app.clients.wait(30)
+    calls_before = sum(app.clients.spreadsheet.calls().values())
+    local = threading.local()
+
+    def post(update):
+        if not hasattr(local, "client"): local.client = app.app.test_client()
+        return local.client.post('/webhook', json=update).status_code
+
+    started = time.monotonic()
+    results = post_all(post, updates, args.concurrency)
+    ack_done = time.monotonic()
+
+    # Tunggu sampai setiap thread menerima balasan (konfirmasi/error) dan antrean tulis kosong
+    done_at = {}
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        for sent_at, method, kwargs in list(app.clients.bot.sent):
+            thread_id = kwargs.get("message_thread_id")
+            if method == "send_message" and thread_id in results and thread_id not in done_at:
+                done_at[thread_id] = sent_at
+        if len(done_at) == len(updates) and app.write_queue.depth() == 0: break
+        time.sleep(0.05)
+    finished = max(done_at.values(), default=ack_done)
+
+    calls = app.clients.spreadsheet.calls()
+    total_calls = sum(calls.values()) - calls_before
+    e2e = [done_at[t] - results[t][0] for t in done_at]
+    print(f"{len(updates)} update, konkurensi {args.concurrency}, latensi Sheets {args.sheets_latency}s, "
+          f"latensi Telegram {args.tg_latency}s")
+    print(f"ACK semua update dalam {ack_done - started:.2f}s ({len(updates) / (ack_done - started):.1f} req/s)")
+    print(f"Selesai end-to-end {len(done_at)}/{len(updates)} dalam {finished - started:.2f}s "
+          f"({len(done_at) / max(finished - started, 1e-9):.1f} pesanan/s), sisa antrean tulis: {app.write_queue.depth()}")
+    report("Latensi ACK", [ack for _, ack, _ in results.values()])
+    report("Latensi end-to-end", e2e)
+    print(f"Panggilan Sheets: {total_calls} ({total_calls / len(updates):.3f} per pesanan)")
+    for name, n in sorted(calls.items()):
+        print(f"  {name:<28} {n}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Uji beban /webhook")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="detik per panggilan Sheets palsu")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0, help="peluang error kuota 429 per panggilan")
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="detik per panggilan Telegram palsu")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0, help="peluang RetryAfter per panggilan")
+    parser.add_argument("--tg-global-rate", type=float, default=1e6,
+                        help="batas pesan/detik global (Telegram asli: 30); default tanpa batas")
+    parser.add_argument("--tg-group-rate", type=float, default=1e6,
+                        help="batas pesan/menit per grup (Telegram asli: 20); default tanpa batas agar yang terukur pipeline")
+    parser.add_argument("--tg-chat-burst", type=int, default=1000, help="burst token bucket per chat")
+    parser.add_argument("--timeout", type=float, default=120, help="batas tunggu penyelesaian (detik)")
+    parser.add_argument("--url", help="URL /webhook server lain (hanya mengukur ACK)")
+    args = parser.parse_args()
+
+    updates = make_updates(args.orders)
+    if args.url: run_remote(args, updates)
+    else: run_local(args, updates)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Pembaca worksheet yang hanya mengambil kolom & rentang baris yang dibutuhkan.
+
+Pengganti get_all_records(): posisi header di-resolve sekali per worksheet,
+kolom diambil lewat batch_get per potongan baris, dan hasilnya di-yield sebagai
+tuple sehingga memori & transfer sebanding dengan jendela yang dibaca, bukan
+dengan seluruh riwayat sheet.
+"""
+
+import re
+import threading
+
+from gspread.utils import rowcol_to_a1
+
+# Jumlah baris per batch_get saat streaming
+CHUNK_ROWS = 2000
+# Titik sampel per putaran pencarian awal jendela tanggal, dan sisa rentang yang cukup dibaca linear
+SEARCH_PROBES = 16
+SEARCH_LINEAR_ROWS = 500
+
+_headers = {}  # judul worksheet -> {nama header: indeks kolom 0-based}
+_headers_lock = threading.Lock()
+
+
+def column_letter(index):
+    """Huruf kolom A1 dari indeks 0-based."""
+    return re.sub(r'\d', '', rowcol_to_a1(1, index + 1))
+
+
+def header_positions(sheet, refresh=False):
+    """Posisi kolom per nama header (baris 1), di-cache per worksheet."""
+    with _headers_lock:
+        cached = None if refresh else _headers.get(sheet.title)
+    if cached is not None: return cached
+    positions = {}
+    for i, name in enumerate(sheet.row_values(1)):
+        positions.setdefault(str(name).strip(), i)
+    with _headers_lock:
+        _headers[sheet.title] = positions
+    return positions
+
+
+def invalidate_headers(title=None):
+    """Membuang cache header (satu worksheet atau semua), mis. setelah kolom sheet diubah."""
+    with _headers_lock:
+        if title is None: _headers.clear()
+        else: _headers.pop(title, None)
+
+
+def _resolve(sheet, columns):
+    """Indeks kolom untuk setiap nama header (int = indeks 0-based langsung); header dibaca ulang sekali jika ada nama yang belum dikenal."""
+    names = [c for c in columns if not isinstance(c, int)]
+    if not names: return list(columns)
+    positions = header_positions(sheet)
+    if any(c not in positions for c in names):
+        positions = header_positions(sheet, refresh=True)
+    missing = [c for c in names if c not in positions]
+    if missing: raise KeyError(f"Kolom {missing} tidak ada di sheet {sheet.title}")
+    return [c if isinstance(c, int) else positions[c] for c in columns]
+
+
+def _spans(indexes):
+    """Mengelompokkan indeks kolom menjadi rentang bersebelahan [(awal, akhir)] agar range batch_get minimal."""
+    spans = []
+    for i in sorted(set(indexes)):
+        if spans and spans[-1][1] == i - 1: spans[-1][1] = i
+        else: spans.append([i, i])
+    return spans
+
+
+def iter_rows(sheet, columns, start_row=2, end_row=None, chunk_rows=CHUNK_ROWS):
+    """Yield tuple nilai `columns` untuk setiap baris mulai start_row (1-based) sampai baris data terakhir.
+
+    Baris kosong di tengah tetap di-yield (berisi string kosong) agar jumlah baris
+    yang dibaca bisa dipakai sebagai penanda posisi (watermark).
+    """
+    indexes = _resolve(sheet, columns)
+    spans = _spans(indexes)
+    row = start_row
+    while end_row is None or row <= end_row:
+        last = row + chunk_rows - 1 if end_row is None else min(row + chunk_rows - 1, end_row)
+        ranges = [f"{column_letter(a)}{row}:{column_letter(b)}{last}" for a, b in spans]
+        blocks = sheet.batch_get(ranges)
+        n_rows = max((len(b) for b in blocks), default=0)
+        if n_rows == 0: return
+
+        # Kolom yang diminta -> (blok, offset di dalam blok)
+        where = []
+        for i in indexes:
+            k = next(k for k, (a, b) in enumerate(spans) if a <= i <= b)
+            where.append((blocks[k], i - spans[k][0]))
+        for r in range(n_rows):
+            yield tuple(str(block[r][off]) if r < len(block) and off < len(block[r]) else "" for block, off in where)
+        if n_rows < last - row + 1: return
+        row = last + 1
+
+
+def find_first_row(sheet, column, target, key, start_row=2, probes=SEARCH_PROBES, linear_rows=SEARCH_LINEAR_ROWS):
+    """Perkiraan baris pertama (1-based) dengan key(nilai) >= target pada kolom yang terurut naik (mis. tanggal input).
+
+    Pencarian k-ary: tiap putaran mengambil `probes` sel dalam satu batch_get sehingga
+    100 ribu baris selesai dalam beberapa panggilan. Sel kosong dianggap sudah melewati
+    akhir data, sel yang tidak bisa di-parse dilewati. Hasilnya batas bawah yang aman:
+    baris sebelum hasil pasti < target, pemanggil tetap memfilter baris yang dibaca.
+    """
+    letter = column_letter(_resolve(sheet, [column])[0])
+    lo, hi = start_row, max(start_row, sheet.row_count + 1)
+    while hi - lo > linear_rows:
+        step = (hi - lo) / (probes + 1)
+        points = sorted({lo + int(step * i) for i in range(1, probes + 1)})
+        cells = sheet.batch_get([f"{letter}{p}" for p in points])
+        new_lo, new_hi = lo, hi
+        for p, cell in zip(points, cells):
+            value = cell[0][0] if cell and cell[0] else ""
+            if not value:
+                new_hi = min(new_hi, p)
+                continue
+            try:
+                before = key(value) < target
+            except (ValueError, TypeError):
+                continue
+            if before: new_lo = max(new_lo, p + 1)
+            else: new_hi = min(new_hi, p)
+        if (new_lo, new_hi) == (lo, hi): break
+        lo, hi = new_lo, max(new_lo, new_hi)
+    return lo
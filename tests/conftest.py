@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""Fixture bersama: app.py dengan backend palsu (fakes.py) dan database state sementara."""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.update({
+    'BOT_BACKEND': 'fake', 'SCHEDULER_ENABLED': '0', 'WRITE_FLUSH_SECONDS': '0.2',
+    'STATE_DB_PATH': os.path.join(tempfile.mkdtemp(prefix="bot-test-"), "state.db"),
+})
+
+
+@pytest.fixture(scope="session")
+def bot_app():
+    import app
+    app.clients.wait(30)
+    return app
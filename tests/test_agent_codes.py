@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Uji cache kode agen (AgentCodeCache) saat sheet AGEN tidak bisa dibaca."""
+
+
+def test_outage_uses_expired_sqlite_snapshot(bot_app, monkeypatch):
+    app = bot_app
+    known = app.agent_codes.snapshot()[0]
+
+    def outage(name):
+        raise ConnectionError("Sheets tidak bisa dihubungi")
+
+    monkeypatch.setattr(app.clients, "sheet", outage)
+    cache = app.AgentCodeCache(app.SHEET_AGEN, ttl=0)  # ttl=0: snapshot SQLite selalu dianggap kedaluwarsa
+    assert cache.contains(known) is True
+    assert cache.contains("Agen Palsu #999") is False
+    assert cache.metrics['refresh_errors'] >= 1
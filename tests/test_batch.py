@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""Uji input batch (ingest_batch) dengan backend palsu."""
+
+from test_webhook import SALES
+
+
+def test_same_street_in_other_region_is_not_batch_duplicate(bot_app):
+    app = bot_app
+    first = SALES.format(n=20_001).replace("Jl. Uji Edit No. 20001", "Jl. Merdeka No. 1")
+    other_region = SALES.format(n=20_002).replace("Jl. Uji Edit No. 20002", "Jl. Merdeka No. 1") \
+        .replace("Kecamatan: Bojonggede", "Kecamatan: Cibinong").replace("Kota Depok", "Kab. Bogor")
+    same_region = SALES.format(n=20_003).replace("Jl. Uji Edit No. 20003", "Jl Merdeka no 1")
+    result = app.ingest_batch([(first, "CS Batch"), (other_region, "CS Batch"), (same_region, "CS Batch")], dry_run=True)
+    assert len(result['accepted']) == 2
+    assert [label for label, _ in result['rejected']] == ["#3 Uji Edit 20003"]
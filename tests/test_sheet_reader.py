@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Uji cache posisi header sheet_reader terhadap perubahan kolom sheet."""
+
+import sheet_reader
+
+
+def test_archive_drops_cached_header_when_header_changes(bot_app):
+    app = bot_app
+    sheet = app.clients.sheet(app.SHEET_CLOSING_MP)
+    header = list(sheet.rows[0])
+    positions = sheet_reader.header_positions(sheet)
+    assert sheet.title in sheet_reader._headers
+
+    sheet.rows[0] = header[:-1] + [header[-1] + " BARU"]
+    try:
+        app.closing_archive.archive(keep_months=1200)  # cutoff jauh di masa lalu: tidak ada baris yang dipindah
+        assert sheet.title not in sheet_reader._headers
+        assert sheet_reader.header_positions(sheet) != positions
+    finally:
+        sheet.rows[0] = header
+    app.closing_archive.archive(keep_months=1200)
+    assert sheet_reader.header_positions(sheet) == positions
+
+
+def test_headers_dropped_on_reconnect(bot_app):
+    assert bot_app.clients._on_ready[0] is sheet_reader.invalidate_headers
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Uji watermark sinkronisasi inkremental (SalesRollup, DupIndex) saat baris sheet dihapus manual."""
+
+import itertools
+from datetime import date
+
+from test_webhook import SALES
+
+_ids = itertools.count(30_000)
+
+
+def append_orders(app, sheet, cs_name, count):
+    """Menulis langsung `count` pesanan ke sheet (seperti writer); mengembalikan order-nya."""
+    orders = [app.parse_order(SALES.format(n=n)) for n in itertools.islice(_ids, count)]
+    sheet.append_rows([app.build_row(order, app.invoice_ids.next(), cs_name, order.pembayaran) for order in orders])
+    return orders
+
+
+def test_rollup_rebuilds_when_counted_rows_are_deleted(bot_app):
+    app = bot_app
+    sheet = app.clients.sheet(app.SHEET_CLOSING)
+    append_orders(app, sheet, "CS Watermark", 3)
+    app.sales_rollup.update()
+    assert app.sales_rollup.totals(date.today(), date.today())["CS Watermark"]['i'] == 3
+
+    del sheet.rows[-3:-1]  # dua baris yang sudah dihitung dihapus manual dari sheet
+    append_orders(app, sheet, "CS Watermark", 1)
+    app.sales_rollup.update()
+    assert app.sales_rollup.totals(date.today(), date.today())["CS Watermark"]['i'] == 2
+
+
+def test_dup_index_resyncs_when_synced_rows_are_deleted(bot_app):
+    app = bot_app
+    index = app.closing_dup_index
+    sheet = app.clients.sheet(app.SHEET_CLOSING)
+    index.sync()
+    deleted, kept = append_orders(app, sheet, "CS Dup", 2)
+    index.sync()
+    assert index.check(deleted.no_hp, deleted.alamat, kecamatan=deleted.kecamatan, kota_kab=deleted.kota_kab)
+
+    del sheet.rows[-2]
+    new, = append_orders(app, sheet, "CS Dup", 1)
+    index.sync()
+    assert index.check(new.no_hp, new.alamat, kecamatan=new.kecamatan, kota_kab=new.kota_kab)
+    assert index.check(kept.no_hp, kept.alamat, kecamatan=kept.kecamatan, kota_kab=kept.kota_kab)
+    assert not index.check(deleted.no_hp, deleted.alamat, kecamatan=deleted.kecamatan, kota_kab=deleted.kota_kab)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Uji /webhook end-to-end dengan backend palsu."""
+
+import time
+import itertools
+from contextlib import closing
+
+from loadtest import make_updates
+
+_ids = itertools.count(10_000)
+
+
+SALES = """SALES {n}
+Doorasi: 10 Sachet Rp 194k
+SKU: DRSA-10
+Ongkir: Rp 33.000
+Total Pembayaran: Rp 630.000
+Ekspedisi: SAP - COD
+Nama: Uji Edit {n}
+No HP: 0857{n:08d}
+Alamat Jalan: Jl. Uji Edit No. {n}
+Desa/Kelurahan: Desa {n}
+Kecamatan: Bojonggede
+Kab/Kota: Kota Depok
+Kode Pos: 19116"""
+
+
+def make_update(text=SALES, **message):
+    """Satu update SALES reguler dengan update_id/message_id/thread/no HP/alamat unik per pemanggilan."""
+    n = next(_ids)
+    update = make_updates(1)[0]
+    update["update_id"] = n
+    update["message"].update(message_id=n, message_thread_id=n, text=text.format(n=n), **message)
+    return update
+
+
+def as_edit(update, text):
+    """Versi edit dari pesan pada update: update_id baru, message_id sama, ada edit_date."""
+    message = dict(update["message"], text=text, edit_date=int(time.time()) + 1)
+    return {"update_id": next(_ids), "edited_message": message}
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate(): return True
+        time.sleep(0.02)
+    return False
+
+
+def sent_to_thread(app, thread_id):
+    return [kw["text"] for _, method, kw in list(app.clients.bot.sent)
+            if method == "send_message" and kw.get("message_thread_id") == thread_id]
+
+
+def post(app, update):
+    assert app.app.test_client().post('/webhook', json=update).status_code == 200
+
+
+def test_edit_after_write_is_not_written_again(bot_app):
+    app = bot_app
+    sheet = app.clients.sheet(app.SHEET_CLOSING)
+    update = make_update()
+    thread_id = update["message"]["message_thread_id"]
+    post(app, update)
+    assert wait_for(lambda: sent_to_thread(app, thread_id) and app.write_queue.depth() == 0)
+    rows_before, errors_before = len(sheet.rows), len(sent_to_thread(app, None))
+
+    post(app, as_edit(update, update["message"]["text"].replace("No HP:", "No HP: 0")))
+    assert wait_for(lambda: app.EDITED_AFTER_WRITE_MSG in sent_to_thread(app, thread_id))
+    time.sleep(0.5)
+    assert len(sheet.rows) == rows_before
+    assert app.write_queue.depth() == 0
+    assert not [t for t in sent_to_thread(app, None)[errors_before:] if t.startswith("Bot Error")]
+    assert not [t for t in sent_to_thread(app, thread_id) if "duplikat" in t.lower() or "🚨" in t]
+
+
+def test_edit_of_rejected_message_is_processed(bot_app):
+    app = bot_app
+    update = make_update()
+    thread_id = update["message"]["message_thread_id"]
+    text = update["message"]["text"]
+    update["message"]["text"] = text.replace("Ongkir:", "Ongkos:")
+    post(app, update)
+    assert wait_for(lambda: any("Missing" in t for t in sent_to_thread(app, thread_id)))
+
+    post(app, as_edit(update, text))
+    assert wait_for(lambda: any("INVOICE" in t for t in sent_to_thread(app, thread_id)))
+    assert app.EDITED_AFTER_WRITE_MSG not in sent_to_thread(app, thread_id)
+
+
+def test_daily_stats_not_double_counted_on_rollover(bot_app):
+    app = bot_app
+    # Seperti hari baru / worker baru start: belum ada seed untuk hari ini
+    with closing(app._db()) as conn, conn:
+        conn.execute("DELETE FROM daily_stats_seeded")
+    app.daily_stats._day = None
+    update = make_update()
+    thread_id = update["message"]["message_thread_id"]
+    cs_name = f"Rollover{thread_id}"
+    update["message"]["from"] = dict(update["message"]["from"], first_name=cs_name)
+    post(app, update)
+    assert wait_for(lambda: sent_to_thread(app, thread_id))
+    assert sent_to_thread(app, thread_id)[0].startswith(f"{cs_name} ★ 1 INVOICE")
+    assert app.daily_stats.get(cs_name)['invoices'] == 1
+
+
+def test_inbox_lease_extended_while_handling(bot_app, monkeypatch):
+    app = bot_app
+    monkeypatch.setattr(app.UpdateInbox, "LEASE_SECONDS", 0.3)
+    slow = app.process_regular_order
+
+    async def slow_order(*args, **kwargs):
+        await app.asyncio.sleep(1.2)  # mis. tertahan rate limit Telegram
+        return await slow(*args, **kwargs)
+
+    monkeypatch.setattr(app, "process_regular_order", slow_order)
+    update = make_update()
+    post(app, update)
+    deadline = time.monotonic() + 1.0
+    while time.monotonic() < deadline:
+        assert update["update_id"] not in [update_id for update_id, _ in app.update_inbox.claim_stale()]
+        time.sleep(0.05)
+    assert wait_for(lambda: sent_to_thread(app, update["message"]["message_thread_id"]))
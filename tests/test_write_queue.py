@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Uji antrean tulis (WriteBehindQueue) dengan baris yang selalu ditolak sheet."""
+
+import itertools
+
+from gspread.exceptions import APIError
+
+import fakes
+from test_webhook import SALES, wait_for
+
+_ids = itertools.count(40_000)
+
+
+class _BadRequest:
+    status_code = 400
+    text = "Invalid value"
+
+    def json(self):
+        return {"error": {"code": 400, "message": self.text, "status": "INVALID_ARGUMENT"}}
+
+
+def test_rejected_row_is_dead_lettered_without_blocking_queue(bot_app, monkeypatch):
+    app = bot_app
+    append_rows = fakes.FakeWorksheet.append_rows
+
+    def reject_poison(self, values, **kwargs):
+        if any("POISON" in str(v) for row in values for v in row): raise APIError(_BadRequest())
+        return append_rows(self, values, **kwargs)
+
+    monkeypatch.setattr(fakes.FakeWorksheet, "append_rows", reject_poison)
+    sheet = app.clients.sheet(app.SHEET_CLOSING)
+    rows = []
+    for n in itertools.islice(_ids, 3):
+        order = app.parse_order(SALES.format(n=n))
+        rows.append(app.build_row(order, f"INV-T{n}", "CS Antrean", order.pembayaran))
+    rows[1][1] = "POISON"
+    dead_before = app.write_queue.dead_letters()
+    # Satu batch: append_rows langsung ditolak, lalu writer menulis ulang per baris
+    assert not app.write_queue.write_now(app.SHEET_CLOSING, rows)
+
+    assert wait_for(lambda: app.write_queue.depth() == 0)
+    invoices = {row[0] for row in sheet.rows}
+    assert {rows[0][0], rows[2][0]} <= invoices and rows[1][0] not in invoices
+    assert app.write_queue.dead_letters() == dead_before + 1
+    assert wait_for(lambda: any("write_dead_letter" in kw["text"] for _, method, kw in list(app.clients.bot.sent)
+                                if method == "send_message"))
+    assert app.clients.ready